@@ -0,0 +1,82 @@
+"""Gunicorn *production* config file"""
+
+import multiprocessing
+import os
+import shutil
+
+# Django WSGI application path in pattern MODULE_NAME:VARIABLE_NAME
+wsgi_app = "storefront.wsgi:application"
+
+# The granularity of Error log outputs
+loglevel = "info"
+
+# Worker processes, each serving requests from a pool of threads. Requests
+# mostly wait on MySQL, so threads give concurrency without a process each.
+# gthread, with the threads connected to the database up front.
+worker_class = "storefront.warmup.WarmThreadWorker"
+workers = int(os.environ.get("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+
+# The socket to bind
+bind = "0.0.0.0:5001"
+
+# Load Django once in the master, workers fork with it already imported
+preload_app = True
+
+# Recycle workers after a random number of requests around max_requests,
+# so they don't all restart at the same time
+max_requests = 1000
+max_requests_jitter = 200
+
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+
+# Worker heartbeat files on tmpfs rather than the container's overlay disk
+worker_tmp_dir = "/dev/shm"
+
+# Access and error logs to stdout/stderr for the container runtime
+accesslog = "-"
+errorlog = "-"
+
+# Keep database connections open between requests, each worker thread has
+# its own (see DATABASES in storefront/settings.py)
+raw_env = ["DB_CONN_MAX_AGE=60"]
+
+# Workers write their request metrics here, /metrics/ adds them up (see
+# storefront/metrics.py)
+metrics_dir = "/tmp/prometheus"
+raw_env.append(f"PROMETHEUS_MULTIPROC_DIR={metrics_dir}")
+
+
+def on_starting(server):
+    # Workers must agree on version counters and auth digests, see
+    # storefront/caches.py
+    from storefront.caches import require_shared_cache
+
+    require_shared_cache(workers)
+
+    # Samples of a previous run must not be counted again
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+
+
+def pre_fork(server, worker):
+    # Connections must never be shared with the forked workers
+    from django.db import connections
+
+    connections.close_all()
+
+
+def post_fork(server, worker):
+    # Runs before the worker accepts connections, see storefront/warmup.py
+    from storefront.warmup import warm_up
+
+    warm_up()
+    server.log.info("Worker %s warmed up", worker.pid)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
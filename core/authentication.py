@@ -0,0 +1,209 @@
+"""
+JWT authentication that does not load the user on every request.
+
+Tokens issued by core.serializers.TokenObtainPairSerializer carry the
+user's is_staff and is_superuser flags and an `auth_digest` of everything
+authorization depends on: those flags, is_active and the user's
+permissions. The current digest of every user is kept in the shared cache.
+While a token's digest matches it, StatelessJWTAuthentication returns a
+TokenPrincipal built from the claims, and the user row is only loaded if a
+view needs more than id, is_staff and is_superuser.
+
+Changes to users, their groups and permissions drop the cached digest (see
+core.signals.handlers), the next request recomputes it and tokens issued
+before the change stop matching. Those are authenticated with the full
+user, like JWTAuthentication does, from a small per-process LRU cache.
+
+This only holds if every process sees the dropped digest. With a
+per-process cache (see storefront.caches) a change made in one process
+would leave the others trusting the old digest for up to
+AUTH_DIGEST_TIMEOUT, so every request is authenticated with the user row,
+exactly like JWTAuthentication.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from storefront.caches import is_process_local
+
+AUTH_DIGEST_CLAIM = "auth_digest"
+# A backstop for changes no signal reports, e.g. a deleted Permission
+AUTH_DIGEST_TIMEOUT = 60 * 60
+
+USER_CACHE_SIZE = getattr(settings, "AUTH_USER_CACHE_SIZE", 1024)
+USER_CACHE_TTL = getattr(settings, "AUTH_USER_CACHE_TTL", 60)
+
+
+def auth_digest_key(user_id):
+    return f"core:auth-digest:{user_id}"
+
+
+def compute_auth_digest(user):
+    state = [str(user.is_active), str(user.is_staff), str(user.is_superuser)]
+    state += sorted(user.get_all_permissions())
+    return hashlib.sha1("\n".join(state).encode()).hexdigest()[:16]
+
+
+class UserCache:
+    """Full user objects by id, each valid for one digest and `ttl` seconds."""
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, user_id, digest):
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                return None
+            user, user_digest, expires_at = entry
+            if user_digest != digest or expires_at < time.monotonic():
+                del self.entries[user_id]
+                return None
+            self.entries.move_to_end(user_id)
+            return user
+
+    def put(self, user, digest):
+        with self.lock:
+            self.entries[user.pk] = (user, digest, time.monotonic() + self.ttl)
+            self.entries.move_to_end(user.pk)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def discard(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+user_cache = UserCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+
+def fetch_user(user_id):
+    """Loads the user and records their digest, None if there is no such user."""
+    User = get_user_model()
+    try:
+        user = User._default_manager.get(pk=user_id)
+    except User.DoesNotExist:
+        return None, None
+    digest = compute_auth_digest(user)
+    cache.set(auth_digest_key(user_id), digest, AUTH_DIGEST_TIMEOUT)
+    user_cache.put(user, digest)
+    return user, digest
+
+
+def get_auth_digest(user_id):
+    digest = cache.get(auth_digest_key(user_id))
+    if digest is None:
+        _, digest = fetch_user(user_id)
+    return digest
+
+
+def get_user(user_id, digest):
+    user = user_cache.get(user_id, digest)
+    if user is None:
+        user, _ = fetch_user(user_id)
+    return user
+
+
+def forget_user(user_id):
+    """Called whenever anything the digest depends on may have changed."""
+    cache.delete(auth_digest_key(user_id))
+    user_cache.discard(user_id)
+
+
+class TokenPrincipal(TokenUser):
+    """
+    The requesting user as described by a token whose digest is current.
+    Permission checks and attributes other than id, is_staff and
+    is_superuser go to the full user, loaded on first use.
+    """
+
+    def __init__(self, token, digest):
+        super().__init__(token)
+        self.digest = digest
+
+    def __str__(self):
+        return str(self.user)
+
+    @cached_property
+    def user(self):
+        user = get_user(self.id, self.digest)
+        if user is None:
+            raise AuthenticationFailed("User not found", code="user_not_found")
+        return user
+
+    @property
+    def username(self):
+        return self.user.get_username()
+
+    def get_username(self):
+        return self.username
+
+    @property
+    def groups(self):
+        return self.user.groups
+
+    @property
+    def user_permissions(self):
+        return self.user.user_permissions
+
+    def get_group_permissions(self, obj=None):
+        return self.user.get_group_permissions(obj)
+
+    def get_all_permissions(self, obj=None):
+        return self.user.get_all_permissions(obj)
+
+    def has_perm(self, perm, obj=None):
+        return self.user.has_perm(perm, obj)
+
+    def has_perms(self, perm_list, obj=None):
+        return self.user.has_perms(perm_list, obj)
+
+    def has_module_perms(self, module):
+        return self.user.has_module_perms(module)
+
+    def __getattr__(self, attr):
+        # Also stops recursion on an instance built without __init__
+        if attr.startswith("_") or attr in ("token", "digest", "user"):
+            raise AttributeError(attr)
+        return getattr(self.user, attr)
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        if is_process_local():
+            return super().get_user(validated_token)
+
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken("Token contained no recognizable user identification")
+
+        digest = get_auth_digest(user_id)
+        if digest is None:
+            raise AuthenticationFailed("User not found", code="user_not_found")
+        if validated_token.get(AUTH_DIGEST_CLAIM) == digest:
+            return TokenPrincipal(validated_token, digest)
+
+        # Issued before the user changed, or before tokens carried a digest
+        user = get_user(user_id, digest)
+        if user is None:
+            raise AuthenticationFailed("User not found", code="user_not_found")
+        if not user.is_active:
+            raise AuthenticationFailed("User is inactive", code="user_inactive")
+        return user
@@ -1,5 +1,10 @@
 from djoser.serializers import UserCreateSerializer as BaseUserCreateSerializer
 from djoser.serializers import UserSerializer as BaseUserSerializer
+from rest_framework_simplejwt.serializers import (
+    TokenObtainPairSerializer as BaseTokenObtainPairSerializer,
+)
+from store.customers import CUSTOMER_ID_CLAIM, lookup_customer_id
+from .authentication import AUTH_DIGEST_CLAIM, get_auth_digest
 
 
 class UserCreateSerializer(BaseUserCreateSerializer):
@@ -10,3 +15,16 @@ class UserCreateSerializer(BaseUserCreateSerializer):
 class UserSerializer(BaseUserSerializer):
     class Meta(BaseUserSerializer.Meta):
         fields = ["id", "username", "email", "first_name", "last_name"]
+
+
+class TokenObtainPairSerializer(BaseTokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        # Copied to every access token refreshed from it, see store.customers
+        token[CUSTOMER_ID_CLAIM] = lookup_customer_id(user.id)
+        # Enough for StatelessJWTAuthentication to skip loading the user
+        token["is_staff"] = user.is_staff
+        token["is_superuser"] = user.is_superuser
+        token[AUTH_DIGEST_CLAIM] = get_auth_digest(user.id)
+        return token
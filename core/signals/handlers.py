@@ -1,7 +1,67 @@
 from store.signals import order_created
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 from django.dispatch import receiver
+from core.authentication import forget_user
 
 
 @receiver(order_created)
 def on_order_created(sender, **kwargs):
-    print(kwargs['order'])
\ No newline at end of file
+    print(kwargs['order'])
+
+
+# Whatever StatelessJWTAuthentication trusts a token's claims for depends on
+# the user row, their groups and the permissions of both. Only the cache
+# this process uses is told, which is why a per-process cache turns the
+# stateless path off (see core.authentication).
+@receiver([post_save, post_delete], sender=settings.AUTH_USER_MODEL)
+def forget_changed_user(sender, instance, **kwargs):
+    forget_user(instance.pk)
+
+
+def forget_users(user_ids):
+    for user_id in user_ids:
+        forget_user(user_id)
+
+
+@receiver(m2m_changed, sender=get_user_model().groups.through)
+@receiver(m2m_changed, sender=get_user_model().user_permissions.through)
+def forget_user_with_changed_permissions(
+    sender, instance, action, reverse, pk_set, **kwargs
+):
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+    if not reverse:
+        forget_user(instance.pk)
+    elif pk_set is not None:
+        forget_users(pk_set)
+    else:
+        # A group or permission about to be taken from all its users
+        forget_users(instance.user_set.values_list("pk", flat=True))
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def forget_members_of_changed_groups(
+    sender, instance, action, reverse, pk_set, **kwargs
+):
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+    if not reverse:
+        groups = [instance.pk]
+    elif pk_set is not None:
+        groups = pk_set
+    else:
+        groups = instance.group_set.values_list("pk", flat=True)
+    forget_users(
+        get_user_model()
+        .objects.filter(groups__in=list(groups))
+        .values_list("pk", flat=True)
+        .distinct()
+    )
+
+
+@receiver(pre_delete, sender=Group)
+def forget_members_of_deleted_group(sender, instance, **kwargs):
+    forget_users(instance.user_set.values_list("pk", flat=True))
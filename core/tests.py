@@ -1,3 +1,94 @@
-from django.test import TestCase
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+from core.authentication import UserCache, user_cache
 
-# Create your tests here.
+
+def share_cache(test):
+    """Lets StatelessJWTAuthentication trust the LocMemCache like Redis."""
+    patcher = mock.patch("core.authentication.is_process_local", return_value=False)
+    patcher.start()
+    test.addCleanup(patcher.stop)
+
+
+class StatelessJWTAuthenticationTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(
+            username="user", email="user@example.com", password="secret-password"
+        )
+
+    def setUp(self):
+        share_cache(self)
+        cache.clear()
+        user_cache.clear()
+        response = self.client.post(
+            "/auth/jwt/create/",
+            {"username": "user", "password": "secret-password"},
+        )
+        self.client.credentials(HTTP_AUTHORIZATION=f"JWT {response.data['access']}")
+
+    def test_current_tokens_need_no_user_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/store/customer/me/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 1)
+        self.assertIn("store_customer", queries[0]["sql"])
+
+    def test_deactivated_users_are_rejected(self):
+        self.user.is_active = False
+        self.user.save()
+
+        response = self.client.get("/store/customer/me/")
+        self.assertEqual(response.status_code, 401)
+
+    def test_permission_changes_apply_to_issued_tokens(self):
+        response = self.client.get(f"/store/customer/{self.user.customer.id}/history/")
+        self.assertEqual(response.status_code, 403)
+
+        group = Group.objects.create(name="support")
+        self.user.groups.add(group)
+        group.permissions.add(Permission.objects.get(codename="view_history"))
+
+        response = self.client.get(f"/store/customer/{self.user.customer.id}/history/")
+        self.assertEqual(response.status_code, 200)
+
+        group.permissions.clear()
+        response = self.client.get(f"/store/customer/{self.user.customer.id}/history/")
+        self.assertEqual(response.status_code, 403)
+
+
+class PerProcessCacheAuthenticationTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(
+            username="user", email="user@example.com", password="secret-password"
+        )
+
+    def setUp(self):
+        cache.clear()
+        user_cache.clear()
+        response = self.client.post(
+            "/auth/jwt/create/",
+            {"username": "user", "password": "secret-password"},
+        )
+        self.client.credentials(HTTP_AUTHORIZATION=f"JWT {response.data['access']}")
+
+    def test_users_deactivated_by_another_process_are_rejected(self):
+        response = self.client.get("/store/customer/me/")
+        self.assertEqual(response.status_code, 200)
+
+        # The other process only drops the digest from its own caches
+        with mock.patch(
+            "core.authentication.cache", LocMemCache("other-process", {})
+        ), mock.patch("core.authentication.user_cache", UserCache(10, 60)):
+            self.user.is_active = False
+            self.user.save()
+
+        response = self.client.get("/store/customer/me/")
+        self.assertEqual(response.status_code, 401)
@@ -19,6 +19,11 @@ then
         --email $DJANGO_SUPERUSER_EMAIL
 fi
 
-echo "Running django server"
-# gunicorn -c config/gunicorn/dev.py
-python manage.py runserver 0.0.0.0:5001
+if [ "$LOCAL_DEV" ]
+then
+    echo "Running django server"
+    python manage.py runserver 0.0.0.0:5001
+else
+    echo "Running gunicorn"
+    exec gunicorn -c config/gunicorn/prod.py
+fi
@@ -0,0 +1,186 @@
+"""
+Async GET/HEAD for the catalog read endpoints (products, collections and
+reviews), used when ASYNC_CATALOG_READS is on, which storefront/asgi.py
+does. Rows come from the async ORM (aiterator, aget) and cached responses
+and version counters from the async cache API (aget, aset), so while a
+response waits on a slow client or on Redis no worker thread is tied up.
+
+Each URL keeps its viewset: authentication, permissions, filters,
+pagination, conditional GET, the response cache and the read plan
+(store.fastpath) are the viewset's own. Writes, and reads negotiated to a
+renderer other than JSON such as the browsable API, fall back to the sync
+viewset.
+"""
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.http import Http404, HttpResponse
+from django.urls import URLPattern
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from storefront.db_routers import pin_primary
+from .caching import (
+    RESPONSE_CACHE_TIMEOUT,
+    CachedResponseMixin,
+    ConditionalResponseMixin,
+    aget_versions,
+    primary_response,
+)
+
+READ_ACTIONS = ["list", "retrieve"]
+
+
+def make_viewset(view, request, args, kwargs):
+    # What ViewSetMixin.as_view() and APIView.dispatch() do before initial()
+    actions = dict(view.actions)
+    actions.setdefault("head", actions["get"])
+    viewset = view.cls(**view.initkwargs)
+    viewset.action_map = actions
+    for method, action in actions.items():
+        setattr(viewset, method, getattr(viewset, action))
+    viewset.args, viewset.kwargs = args, kwargs
+    viewset.request = viewset.initialize_request(request, *args, **kwargs)
+    viewset.headers = viewset.default_response_headers
+    return viewset
+
+
+async def filtered_rows(viewset):
+    queryset = viewset.get_queryset()
+    if viewset.request.query_params:
+        # Filters may validate against the database, e.g. ?collection_id= is
+        # looked up by ModelChoiceFilter.
+        queryset = await sync_to_async(viewset.filter_queryset)(queryset)
+    else:
+        queryset = viewset.filter_queryset(queryset)
+    return viewset.get_rows(queryset)
+
+
+async def list_rows(viewset):
+    request = viewset.request
+    rows = await filtered_rows(viewset)
+
+    paginator = viewset.paginator
+    if paginator is not None and hasattr(paginator, "aget_page_queryset"):
+        page = await paginator.aget_page_queryset(rows, request, viewset)
+        if page is not None:
+            page = paginator.finish_page([row async for row in page.aiterator()])
+            data = viewset.read_plan.render(page, request)
+            return paginator.get_paginated_response(data)
+    elif paginator is not None:
+        # A paginator without an async path counts and slices in a thread
+        page = await sync_to_async(viewset.paginate_queryset)(rows)
+        if page is not None:
+            data = viewset.read_plan.render(page, request)
+            return viewset.get_paginated_response(data)
+
+    rows = [row async for row in rows.aiterator()]
+    return Response(viewset.read_plan.render(rows, request))
+
+
+async def retrieve_row(viewset):
+    rows = await filtered_rows(viewset)
+    try:
+        row = await rows.aget(**viewset.get_lookup())
+    except (rows.model.DoesNotExist, TypeError, ValueError, ValidationError):
+        raise Http404
+    return Response(viewset.read_plan.render([row], viewset.request)[0])
+
+
+async def cached_rows(viewset):
+    fetch = list_rows if viewset.action == "list" else retrieve_row
+    request = viewset.request
+    if not isinstance(viewset, CachedResponseMixin) or request.user.is_authenticated:
+        return await fetch(viewset)
+
+    # Same entries as the sync path. There is no recompute lock here, waiting
+    # on it would block the event loop.
+    versions = await aget_versions(viewset.cache_models)
+    key = viewset.get_response_cache_key(request, versions)
+    cached = await cache.aget(key)
+    if cached is not None:
+        return primary_response(cached)
+    with pin_primary():
+        response = await fetch(viewset)
+    response.from_primary = True
+    if response.status_code == 200:
+        await cache.aset(key, response.data, RESPONSE_CACHE_TIMEOUT)
+    return response
+
+
+async def read(viewset):
+    if not isinstance(viewset, ConditionalResponseMixin):
+        return await cached_rows(viewset)
+
+    response = await viewset.acheck_not_modified(viewset.request)
+    if response is None:
+        response = await cached_rows(viewset)
+    return viewset.add_validators(response)
+
+
+def rendered(response):
+    """
+    A plain HttpResponse with the rendered body. Django's async handler
+    renders template responses (which DRF's Response is) in a thread.
+    """
+    if not isinstance(response, Response):
+        return response
+    response.render()
+    plain = HttpResponse(response.content, status=response.status_code)
+    for header, value in response.items():
+        plain[header] = value
+    return plain
+
+
+def async_read_view(view):
+    async def read_view(request, *args, **kwargs):
+        if request.method in ("GET", "HEAD"):
+            viewset = make_viewset(view, request, args, kwargs)
+            drf_request = viewset.request
+            try:
+                if "HTTP_AUTHORIZATION" in request.META:
+                    # Authenticating a token loads the user from the database
+                    await sync_to_async(viewset.initial)(drf_request, *args, **kwargs)
+                else:
+                    viewset.initial(drf_request, *args, **kwargs)
+                is_json = isinstance(drf_request.accepted_renderer, JSONRenderer)
+                response = await read(viewset) if is_json else None
+            except Exception as exc:
+                response = viewset.handle_exception(exc)
+
+            if response is not None:
+                response = viewset.finalize_response(
+                    drf_request, response, *args, **kwargs
+                )
+                return rendered(response)
+
+        return await sync_to_async(view)(request, *args, **kwargs)
+
+    # The sync view is exempt too, DRF enforces CSRF for session auth itself
+    read_view.csrf_exempt = True
+    read_view.cls, read_view.initkwargs = view.cls, view.initkwargs
+    read_view.actions = view.actions
+    return read_view
+
+
+def async_read_urls(urlpatterns):
+    """
+    `urlpatterns` with the list/retrieve routes of viewsets that have a
+    read plan (see store.fastpath) swapped for their async version.
+    """
+    patterns = []
+    for pattern in urlpatterns:
+        view = pattern.callback
+        viewset = getattr(view, "cls", None)
+        if (
+            getattr(viewset, "read_plan", None) is not None
+            and view.actions.get("get") in READ_ACTIONS
+        ):
+            pattern = URLPattern(
+                pattern.pattern,
+                async_read_view(view),
+                pattern.default_args,
+                pattern.name,
+            )
+        patterns.append(pattern)
+    return patterns
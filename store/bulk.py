@@ -0,0 +1,42 @@
+"""
+Helpers for code that reads or writes whole tables: the catalog and data
+commands, exports and the admin CSV export.
+"""
+
+from django.core.management.color import no_style
+from django.db import connections, router
+
+
+def row_id(row):
+    return row["id"] if isinstance(row, dict) else row.pk
+
+
+def batches_by_id(queryset, batch_size):
+    """
+    Yields the rows of `queryset` in id order, `batch_size` at a time, each
+    batch read by its own WHERE id > last ORDER BY id LIMIT batch_size query.
+    iterator() would stream from a server-side cursor on PostgreSQL but
+    MySQL's client fetches the whole result first. values() querysets must
+    include "id".
+    """
+    queryset = queryset.order_by("pk")
+    batch = list(queryset[:batch_size])
+    while batch:
+        yield batch
+        if len(batch) < batch_size:
+            return
+        batch = list(queryset.filter(pk__gt=row_id(batch[-1]))[:batch_size])
+
+
+def reset_sequences(*models):
+    """
+    Moves the id sequences of `models` past their largest id, after rows
+    were inserted with explicit ids. Only PostgreSQL and Oracle need it,
+    MySQL and SQLite continue after the largest id by themselves.
+    """
+    connection = connections[router.db_for_write(models[0])]
+    statements = connection.ops.sequence_reset_sql(no_style(), models)
+    if statements:
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
@@ -0,0 +1,227 @@
+import hashlib
+import time
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag, urlencode
+from rest_framework.response import Response
+from storefront.db_routers import pin_primary, reading_from_replica
+
+RESPONSE_CACHE_TIMEOUT = 60 * 5
+
+# How long a recompute may hold the lock before waiting requests give up on it
+RECOMPUTE_LOCK_TIMEOUT = 10
+RECOMPUTE_POLL_INTERVAL = 0.05
+
+
+def version_key(model):
+    return f"store:version:{model._meta.label_lower}"
+
+
+def get_versions(models):
+    keys = [version_key(model) for model in models]
+    versions = cache.get_many(keys)
+
+    for key in keys:
+        if key not in versions:
+            # Counters start at the current time rather than at 1, so a counter
+            # that was evicted never comes back with a value that old responses
+            # were cached under.
+            cache.add(key, time.time_ns(), None)
+            versions[key] = cache.get(key, 0)
+
+    return [versions[key] for key in keys]
+
+
+async def aget_versions(models):
+    """get_versions() on the async cache API."""
+    keys = [version_key(model) for model in models]
+    versions = await cache.aget_many(keys)
+
+    for key in keys:
+        if key not in versions:
+            await cache.aadd(key, time.time_ns(), None)
+            versions[key] = await cache.aget(key, 0)
+
+    return [versions[key] for key in keys]
+
+
+def bump_version(model):
+    key = version_key(model)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+    cache.set(changed_at_key(model), int(time.time()), None)
+
+
+def changed_at_key(model):
+    return version_key(model) + ":changed_at"
+
+
+def get_last_modified(models):
+    """Unix time of the latest version bump of any of `models`."""
+    keys = [changed_at_key(model) for model in models]
+    changed_at = cache.get_many(keys)
+
+    for key in keys:
+        if key not in changed_at:
+            # Unknown (evicted or never bumped), claiming a change right now
+            # makes clients fetch once more instead of keeping stale data.
+            cache.add(key, int(time.time()), None)
+            changed_at[key] = cache.get(key, int(time.time()))
+
+    return max(changed_at.values())
+
+
+async def aget_last_modified(models):
+    """get_last_modified() on the async cache API."""
+    keys = [changed_at_key(model) for model in models]
+    changed_at = await cache.aget_many(keys)
+
+    for key in keys:
+        if key not in changed_at:
+            await cache.aadd(key, int(time.time()), None)
+            changed_at[key] = await cache.aget(key, int(time.time()))
+
+    return max(changed_at.values())
+
+
+def primary_response(data):
+    response = Response(data)
+    response.from_primary = True
+    return response
+
+
+class ConditionalResponseMixin:
+    """
+    Adds ETag/Last-Modified to list/retrieve responses and answers
+    If-None-Match/If-Modified-Since with 304 Not Modified before the view
+    runs. Both validators come from the version counters of `cache_models`,
+    so a revalidation costs a cache lookup and no query or serialization.
+    That needs a cache shared by every process (see storefront.caches): with
+    a counter per process, a worker that didn't see a change would keep
+    answering 304.
+
+    Responses read from a replica get no validators: the replica may not
+    have the change the counters already report yet, and the client would
+    keep its stale copy until the next change.
+    """
+
+    cache_models = []
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(super().retrieve, request, *args, **kwargs)
+
+    def get_etag(self, request, versions):
+        # The same URL renders differently per format (Accept) and, in the
+        # browsable API, per user.
+        query = urlencode(sorted(request.GET.lists()), doseq=True)
+        raw = "|".join(
+            [
+                request.build_absolute_uri(request.path),
+                query,
+                str(versions),
+                request.META.get("HTTP_ACCEPT", ""),
+                str(request.user.pk if request.user else None),
+            ]
+        )
+        return quote_etag(hashlib.sha1(raw.encode("utf-8")).hexdigest())
+
+    def check_not_modified(self, request):
+        """A 304 response if the client's copy is current, otherwise None."""
+        self.etag = self.get_etag(request, get_versions(self.cache_models))
+        self.last_modified = get_last_modified(self.cache_models)
+        return get_conditional_response(
+            request, etag=self.etag, last_modified=self.last_modified
+        )
+
+    async def acheck_not_modified(self, request):
+        """check_not_modified() on the async cache API."""
+        self.etag = self.get_etag(request, await aget_versions(self.cache_models))
+        self.last_modified = await aget_last_modified(self.cache_models)
+        return get_conditional_response(
+            request, etag=self.etag, last_modified=self.last_modified
+        )
+
+    def add_validators(self, response):
+        if reading_from_replica() and not getattr(response, "from_primary", False):
+            return response
+        if response.status_code in (200, 304):
+            response["ETag"] = self.etag
+            response["Last-Modified"] = http_date(self.last_modified)
+        return response
+
+    def conditional_response(self, view, request, *args, **kwargs):
+        response = self.check_not_modified(request)
+        if response is None:
+            response = view(request, *args, **kwargs)
+        return self.add_validators(response)
+
+
+class CachedResponseMixin:
+    """
+    Caches anonymous list/retrieve responses under the full URL plus the
+    version counters of `cache_models`. Saving or deleting any of those
+    models bumps its counter (see store.signals.handlers), so stale entries
+    are simply never read again and expire on their own. Like the counters,
+    the entries must be in a cache shared by every process.
+
+    Entries are always read from the primary. A replica that lags behind
+    would have the old rows cached under the new version.
+    """
+
+    cache_models = []
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def get_response_cache_key(self, request, versions):
+        # Hyperlinks and pagination links are absolute, so scheme and host are
+        # part of the key. Query parameters are sorted so ?a=1&b=2 and ?b=2&a=1
+        # share an entry.
+        url = request.build_absolute_uri(request.path)
+        query = urlencode(sorted(request.GET.lists()), doseq=True)
+        raw = f"{url}?{query}|{versions}"
+        return "store:response:" + hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def cached_response(self, view, request, *args, **kwargs):
+        if request.user and request.user.is_authenticated:
+            return view(request, *args, **kwargs)
+
+        key = self.get_response_cache_key(request, get_versions(self.cache_models))
+        cached = cache.get(key)
+        if cached is not None:
+            return primary_response(cached)
+
+        # Only the request that wins the lock recomputes, everyone else missing
+        # on the same key waits for its result instead of hitting the database.
+        lock_key = key + ":lock"
+        locked = cache.add(lock_key, 1, RECOMPUTE_LOCK_TIMEOUT)
+        if not locked:
+            deadline = time.monotonic() + RECOMPUTE_LOCK_TIMEOUT
+            while time.monotonic() < deadline:
+                time.sleep(RECOMPUTE_POLL_INTERVAL)
+                cached = cache.get(key)
+                if cached is not None:
+                    return primary_response(cached)
+                if cache.get(lock_key) is None:
+                    # The response was not cacheable (e.g. an error)
+                    break
+
+        try:
+            with pin_primary():
+                response = view(request, *args, **kwargs)
+            response.from_primary = True
+            if response.status_code == 200:
+                cache.set(key, response.data, RESPONSE_CACHE_TIMEOUT)
+        finally:
+            if locked:
+                cache.delete(lock_key)
+
+        return response
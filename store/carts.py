@@ -0,0 +1,368 @@
+"""
+Cache-backed cart storage, enabled with CART_STORAGE = "cache".
+
+Live carts are kept in the Django cache as {"created_at", "items"} where
+items maps product id to quantity. In this mode a cart item's id is its
+product id, so item URLs stay the same whether the cart is read from the
+cache or loaded back from the database.
+
+Changed carts are written to the database in batches by
+`manage.py flush_carts`, and by checkout under the cart's lock. The first
+change to a cart after it was flushed sets its dirty flag and appends the
+cart id to the dirty log, a counter and one key per entry, so recording a
+change takes no lock and never rewrites a shared value. Flushing holds each cart's
+lock, the lock checkout also holds, so a flush can't write a cart back
+after an order deleted it.
+"""
+
+import time
+from contextlib import contextmanager, nullcontext
+from itertools import islice
+from uuid import UUID, uuid4
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import Http404
+from django.utils import timezone
+from rest_framework.exceptions import APIException
+from .models import Cart, CartItem, Product
+
+CART_TIMEOUT = getattr(settings, "CART_CACHE_TIMEOUT", 60 * 60 * 24 * 7)
+LOCK_TIMEOUT = 5
+LOCK_POLL_INTERVAL = 0.01
+FLUSH_LOCK_TIMEOUT = 60 * 10
+# A cart whose log entry was lost is logged again on its first change
+# after this long
+DIRTY_TIMEOUT = 60 * 60
+
+DIRTY_LOG_KEY = "store:carts:dirty"
+FLUSHED_KEY = "store:carts:flushed"
+# The first log entry found missing by the previous flush
+MISSING_KEY = "store:carts:missing"
+FLUSH_LOCK_KEY = "store:carts:flush:lock"
+
+
+class CartBusy(APIException):
+    status_code = 409
+    default_detail = "The cart is being changed by another request, try again."
+    default_code = "cart_busy"
+
+
+def cache_enabled():
+    return getattr(settings, "CART_STORAGE", "database") == "cache"
+
+
+def cart_key(cart_id):
+    return f"store:cart:{cart_id}"
+
+
+def dirty_key(cart_id):
+    return f"store:cart:{cart_id}:dirty"
+
+
+def log_entry_key(position):
+    return f"store:carts:dirty:{position}"
+
+
+def lock_key(cart_id):
+    return f"store:cart:{cart_id}:lock"
+
+
+def acquire_lock(key, timeout):
+    """The lock's token, or None if someone else holds it."""
+    token = uuid4().hex
+    return token if cache.add(key, token, timeout) else None
+
+
+def release_lock(key, token):
+    # Not atomic, but the lock can only change hands in between if it
+    # expired, and then it is no longer ours to keep anyway
+    if cache.get(key) == token:
+        cache.delete(key)
+
+
+@contextmanager
+def cart_lock(cart_id):
+    """Raises CartBusy if the cart stays locked for LOCK_TIMEOUT seconds."""
+    key = lock_key(cart_id)
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while (token := acquire_lock(key, LOCK_TIMEOUT)) is None:
+        if time.monotonic() >= deadline:
+            raise CartBusy()
+        time.sleep(LOCK_POLL_INTERVAL)
+    try:
+        yield
+    finally:
+        release_lock(key, token)
+
+
+def checkout_lock(cart_id):
+    """Held while an order is placed from the cart."""
+    return cart_lock(cart_id) if cache_enabled() else nullcontext()
+
+
+def parse_cart_id(cart_id):
+    try:
+        return UUID(str(cart_id))
+    except ValueError:
+        raise Http404
+
+
+def parse_product_id(product_id):
+    try:
+        return int(product_id)
+    except ValueError:
+        raise Http404
+
+
+def load_state(cart_id):
+    state = cache.get(cart_key(cart_id))
+    if state is not None:
+        return state
+
+    # Not cached (new worker, evicted, or written before the cache was on)
+    cart = Cart.objects.filter(pk=cart_id).values("created_at").first()
+    if cart is None:
+        return None
+    state = {
+        "created_at": cart["created_at"],
+        "items": dict(
+            CartItem.objects.filter(cart_id=cart_id)
+            .order_by("id")
+            .values_list("product_id", "quantity")
+        ),
+    }
+    cache.add(cart_key(cart_id), state, CART_TIMEOUT)
+    return cache.get(cart_key(cart_id), state)
+
+
+def mark_dirty(cart_id):
+    if not cache.add(dirty_key(cart_id), 1, DIRTY_TIMEOUT):
+        # Already logged and not flushed since
+        return
+    try:
+        position = cache.incr(DIRTY_LOG_KEY)
+    except ValueError:
+        cache.add(DIRTY_LOG_KEY, 0, None)
+        position = cache.incr(DIRTY_LOG_KEY)
+    cache.set(log_entry_key(position), str(cart_id), CART_TIMEOUT)
+
+
+def save_state(cart_id, state):
+    cache.set(cart_key(cart_id), state, CART_TIMEOUT)
+    mark_dirty(cart_id)
+
+
+@contextmanager
+def edit_cart(cart_id):
+    cart_id = parse_cart_id(cart_id)
+    with cart_lock(cart_id):
+        state = load_state(cart_id)
+        if state is None:
+            raise Http404
+        yield state
+        save_state(cart_id, state)
+
+
+def build_cart(cart_id, state):
+    """
+    Unsaved Cart/CartItem instances carrying the same annotations as
+    Cart.objects.with_totals(), so the regular serializers can render them.
+    """
+    products = Product.objects.with_price_with_tax().in_bulk(list(state["items"]))
+    cart = Cart(id=cart_id, created_at=state["created_at"])
+    items = []
+    for product_id, quantity in state["items"].items():
+        product = products.get(product_id)
+        if product is None:
+            continue
+        item = CartItem(id=product_id, cart=cart, product=product, quantity=quantity)
+        item.total_price = product.unit_price * quantity
+        items.append(item)
+
+    cart.total_cart_value = sum((item.total_price for item in items), 0)
+    cart._prefetched_objects_cache = {"cartitems": items}
+    return cart
+
+
+def create_cart():
+    cart_id = uuid4()
+    save_state(cart_id, {"created_at": timezone.now(), "items": {}})
+    return Cart(id=cart_id)
+
+
+def get_cart(cart_id):
+    cart_id = parse_cart_id(cart_id)
+    state = load_state(cart_id)
+    if state is None:
+        raise Http404
+    return build_cart(cart_id, state)
+
+
+def get_item(cart, product_id):
+    for item in cart.cartitems.all():
+        if item.id == parse_product_id(product_id):
+            return item
+    raise Http404
+
+
+def add_item(cart_id, product_id, quantity):
+    with edit_cart(cart_id) as state:
+        state["items"][product_id] = state["items"].get(product_id, 0) + quantity
+        quantity = state["items"][product_id]
+    return CartItem(
+        id=product_id, cart_id=cart_id, product_id=product_id, quantity=quantity
+    )
+
+
+def set_quantity(cart_id, product_id, quantity):
+    product_id = parse_product_id(product_id)
+    with edit_cart(cart_id) as state:
+        if product_id not in state["items"]:
+            raise Http404
+        state["items"][product_id] = quantity
+    return CartItem(
+        id=product_id, cart_id=cart_id, product_id=product_id, quantity=quantity
+    )
+
+
+def remove_item(cart_id, product_id):
+    product_id = parse_product_id(product_id)
+    with edit_cart(cart_id) as state:
+        if state["items"].pop(product_id, None) is None:
+            raise Http404
+
+
+def delete_cart(cart_id):
+    cart_id = parse_cart_id(cart_id)
+    with cart_lock(cart_id):
+        if load_state(cart_id) is None:
+            raise Http404
+        discard_cart(cart_id)
+        Cart.objects.filter(pk=cart_id).delete()
+
+
+def discard_cart(cart_id):
+    if cache_enabled():
+        cache.delete(cart_key(cart_id))
+
+
+def persist_carts(cart_ids):
+    """
+    Writes the cached carts to the database. Carts no longer in the cache,
+    deleted or checked out, are skipped. Callers hold the carts' locks.
+    """
+    states = cache.get_many([cart_key(cart_id) for cart_id in cart_ids])
+    states = {UUID(key.rsplit(":", 1)[1]): state for key, state in states.items()}
+    if not states:
+        return 0
+
+    with transaction.atomic():
+        Cart.objects.bulk_create(
+            [
+                Cart(id=cart_id, created_at=state["created_at"])
+                for cart_id, state in states.items()
+            ],
+            ignore_conflicts=True,
+        )
+        CartItem.objects.filter(cart_id__in=list(states)).delete()
+        existing_products = set(
+            Product.objects.filter(
+                id__in={
+                    product_id
+                    for state in states.values()
+                    for product_id in state["items"]
+                }
+            ).values_list("id", flat=True)
+        )
+        CartItem.objects.bulk_create(
+            [
+                CartItem(cart_id=cart_id, product_id=product_id, quantity=quantity)
+                for cart_id, state in states.items()
+                for product_id, quantity in state["items"].items()
+                if product_id in existing_products
+            ]
+        )
+    return len(states)
+
+
+def persist_cart(cart_id):
+    """
+    Writes a cached cart to the database, a no-op with database storage.
+    Callers hold the cart's lock, see checkout_lock().
+    """
+    if cache_enabled():
+        persist_carts([parse_cart_id(cart_id)])
+
+
+def flush_logged_carts(cart_ids):
+    # Cleared first: a change made from here on logs the cart again
+    cache.delete_many([dirty_key(cart_id) for cart_id in cart_ids])
+
+    tokens, busy = {}, []
+    for cart_id in cart_ids:
+        token = acquire_lock(lock_key(cart_id), LOCK_TIMEOUT)
+        if token is None:
+            busy.append(cart_id)
+        else:
+            tokens[cart_id] = token
+    try:
+        flushed = persist_carts(list(tokens))
+    finally:
+        for cart_id, token in tokens.items():
+            release_lock(lock_key(cart_id), token)
+
+    # Left for the next flush rather than waited for
+    for cart_id in busy:
+        mark_dirty(cart_id)
+    return flushed
+
+
+def flush_dirty_carts(batch_size=500):
+    """
+    Writes the carts in the dirty log to the database. Returns how many
+    were written, None if another flush is running.
+    """
+    token = acquire_lock(FLUSH_LOCK_KEY, FLUSH_LOCK_TIMEOUT)
+    if token is None:
+        return None
+    try:
+        return flush_dirty_log(batch_size)
+    finally:
+        release_lock(FLUSH_LOCK_KEY, token)
+
+
+def flush_dirty_log(batch_size):
+    last = cache.get(DIRTY_LOG_KEY, 0)
+    flushed_up_to = cache.get(FLUSHED_KEY, 0)
+    if flushed_up_to > last:
+        # The log was evicted and started over
+        flushed_up_to = 0
+    missed_before = cache.get(MISSING_KEY)
+
+    # An entry can be missing because its writer is between incr() and
+    # set(). The log is only flushed up to the first missing entry, which
+    # is given up on if it is still missing on the next flush.
+    missing, flushed = None, 0
+    positions = iter(range(flushed_up_to + 1, last + 1))
+    while batch := list(islice(positions, batch_size)):
+        keys = [log_entry_key(position) for position in batch]
+        entries = cache.get_many(keys)
+        cart_ids = list(dict.fromkeys(UUID(cart_id) for cart_id in entries.values()))
+        flushed += flush_logged_carts(cart_ids)
+
+        for position, key in zip(batch, keys):
+            if missing is None and key not in entries and position != missed_before:
+                missing = position
+        # Entries past the first missing one are read again next time
+        cache.delete_many(
+            [
+                key
+                for position, key in zip(batch, keys)
+                if missing is None or position < missing
+            ]
+        )
+
+    cache.set(FLUSHED_KEY, last if missing is None else missing - 1, None)
+    cache.set(MISSING_KEY, missing, None)
+    return flushed
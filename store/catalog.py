@@ -0,0 +1,69 @@
+"""
+Streaming CSV / JSON Lines readers and writers shared by the
+`export_catalog` and `import_catalog` management commands.
+
+A catalog directory holds promotions, collections and products files
+(e.g. products.csv or products.jsonl), one row per line. Product
+promotions are a list of promotion ids, ";" separated in CSV.
+"""
+
+import csv
+import json
+from pathlib import Path
+from django.core.serializers.json import DjangoJSONEncoder
+
+FORMATS = ["csv", "jsonl"]
+
+PROMOTION_FIELDS = ["id", "description", "discount"]
+COLLECTION_FIELDS = ["id", "title", "featured_product_id"]
+PRODUCT_FIELDS = [
+    "id",
+    "title",
+    "slug",
+    "description",
+    "unit_price",
+    "inventory",
+    "collection_id",
+    "promotions",
+]
+
+
+def catalog_path(directory, name, format):
+    return Path(directory) / f"{name}.{format}"
+
+
+def read_rows(path, format):
+    """Yields (line number, row dict) without loading the file in memory."""
+    with open(path, newline="", encoding="utf-8") as file:
+        if format == "csv":
+            # Line 1 is the header
+            for line_number, row in enumerate(csv.DictReader(file), start=2):
+                row = {
+                    key: (value if value != "" else None) for key, value in row.items()
+                }
+                if "promotions" in row:
+                    row["promotions"] = [
+                        int(id) for id in (row["promotions"] or "").split(";") if id
+                    ]
+                yield line_number, row
+        else:
+            for line_number, line in enumerate(file, start=1):
+                if line.strip():
+                    yield line_number, json.loads(line)
+
+
+class RowWriter:
+    def __init__(self, file, format, fields):
+        self.format = format
+        self.file = file
+        if format == "csv":
+            self.writer = csv.DictWriter(file, fieldnames=fields)
+            self.writer.writeheader()
+
+    def write(self, row):
+        if self.format == "csv":
+            if "promotions" in row:
+                row = {**row, "promotions": ";".join(map(str, row["promotions"]))}
+            self.writer.writerow(row)
+        else:
+            self.file.write(json.dumps(row, cls=DjangoJSONEncoder) + "\n")
@@ -0,0 +1,45 @@
+"""
+The customer id of the requesting user without a query per request.
+
+Access tokens issued by core.serializers.TokenObtainPairSerializer carry it
+as the `customer_id` claim. Tokens issued before that, and requests that
+are not JWT authenticated, fall back to a lookup cached per user.
+"""
+
+from django.core.cache import cache
+from .models import Customer
+
+CUSTOMER_ID_CLAIM = "customer_id"
+CUSTOMER_ID_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def customer_id_key(user_id):
+    return f"store:customer-id:{user_id}"
+
+
+def lookup_customer_id(user_id):
+    key = customer_id_key(user_id)
+    customer_id = cache.get(key)
+    if customer_id is None:
+        customer_id = (
+            Customer.objects.filter(user_id=user_id)
+            .values_list("id", flat=True)
+            .first()
+        )
+        if customer_id is not None:
+            cache.set(key, customer_id, CUSTOMER_ID_CACHE_TIMEOUT)
+    return customer_id
+
+
+def get_customer_id(request):
+    """The requesting user's customer id, None if they have no customer."""
+    token = request.auth
+    if token is not None and hasattr(token, "get"):
+        customer_id = token.get(CUSTOMER_ID_CLAIM)
+        if customer_id is not None:
+            return customer_id
+    return lookup_customer_id(request.user.id)
+
+
+def forget_customer_id(user_id):
+    cache.delete(customer_id_key(user_id))
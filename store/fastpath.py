@@ -0,0 +1,138 @@
+"""
+Read-only fast path for list/retrieve on serializers that are flat enough to
+be rendered straight from .values() rows.
+
+A ReadPlan is compiled once from the serializer's fields into (name,
+column, converter) steps. Rendering a row is then a dict comprehension, no
+model instances, field binding or per-field dispatch. The output must stay
+identical to the serializer's, store.tests checks both paths render the
+same bytes.
+"""
+
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework import serializers
+from rest_framework.generics import get_object_or_404
+from rest_framework.response import Response
+from rest_framework.reverse import reverse
+
+URL_PLACEHOLDER = "__pk__"
+
+
+class ReadPlan:
+    """
+    `columns` maps serializer fields that are not plain model fields (e.g. a
+    SerializerMethodField returning an annotation) to the .values() column
+    holding their final value.
+    """
+
+    def __init__(self, serializer_class, columns=None):
+        self.serializer_class = serializer_class
+        self.columns = columns or {}
+        self.steps = None
+
+    def compile(self):
+        steps = []
+        for name, field in self.serializer_class().fields.items():
+            if field.write_only:
+                continue
+            if name in self.columns:
+                steps.append((name, self.columns[name], None))
+            elif isinstance(field, serializers.HyperlinkedRelatedField):
+                steps.append((name, field.source + "_id", field))
+            elif isinstance(
+                field,
+                (
+                    serializers.DecimalField,
+                    serializers.DateField,
+                    serializers.DateTimeField,
+                ),
+            ):
+                steps.append((name, field.source, field.to_representation))
+            elif isinstance(field, (serializers.IntegerField, serializers.CharField)):
+                steps.append((name, field.source, None))
+            else:
+                raise ImproperlyConfigured(
+                    f"{self.serializer_class.__name__}.{name} "
+                    f"({type(field).__name__}) has no fast path"
+                )
+        self.steps = steps
+
+    def get_columns(self):
+        if self.steps is None:
+            self.compile()
+        return [column for _, column, _ in self.steps]
+
+    def get_converters(self, request):
+        converters = []
+        for name, column, convert in self.steps:
+            if isinstance(convert, serializers.HyperlinkedRelatedField):
+                convert = self.get_url_converter(convert, request)
+            converters.append((name, column, convert))
+        return converters
+
+    def get_url_converter(self, field, request):
+        # Reverse and build the absolute URL once, then only splice in the pk
+        template = reverse(
+            field.view_name,
+            kwargs={field.lookup_url_kwarg: URL_PLACEHOLDER},
+            request=request,
+        )
+        prefix, suffix = template.rsplit(URL_PLACEHOLDER, 1)
+        return lambda pk: f"{prefix}{pk}{suffix}"
+
+    def render(self, rows, request):
+        converters = self.get_converters(request)
+        return [
+            {
+                name: (
+                    row[column]
+                    if convert is None or row[column] is None
+                    else convert(row[column])
+                )
+                for name, column, convert in converters
+            }
+            for row in rows
+        ]
+
+
+class FastReadMixin:
+    """
+    Serves list/retrieve from `read_plan` when set. Filtering, pagination
+    and lookups go through the regular viewset hooks on a .values() queryset.
+    Rows are not model instances, so there are no object permission checks:
+    only use it on viewsets whose permissions don't have any.
+    """
+
+    read_plan = None
+
+    def get_rows(self, queryset):
+        # Annotations the filters added (e.g. search_rank) can't be selected
+        # once values() has been called, keep them for the pagination cursor.
+        columns = self.read_plan.get_columns()
+        return queryset.values(
+            *columns,
+            *(name for name in queryset.query.annotations if name not in columns),
+        )
+
+    def get_lookup(self):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        return {self.lookup_field: self.kwargs[lookup_url_kwarg]}
+
+    def list(self, request, *args, **kwargs):
+        if self.read_plan is None:
+            return super().list(request, *args, **kwargs)
+
+        rows = self.get_rows(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            data = self.read_plan.render(page, request)
+            return self.get_paginated_response(data)
+        return Response(self.read_plan.render(rows, request))
+
+    def retrieve(self, request, *args, **kwargs):
+        if self.read_plan is None:
+            return super().retrieve(request, *args, **kwargs)
+
+        rows = self.get_rows(self.filter_queryset(self.get_queryset()))
+        row = get_object_or_404(rows, **self.get_lookup())
+        return Response(self.read_plan.render([row], request)[0])
@@ -1,8 +1,14 @@
 from django_filters.rest_framework import FilterSet
-from .models import Product
+from .models import Order, Product
 
 
 class ProductFilter(FilterSet):
     class Meta:
         model = Product
         fields = {"collection_id": ["exact"], "unit_price": ["gt", "lt"]}
+
+
+class OrderFilter(FilterSet):
+    class Meta:
+        model = Order
+        fields = {"placed_at": ["gte", "lt"], "payment_status": ["exact"]}
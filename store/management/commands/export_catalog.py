@@ -0,0 +1,85 @@
+from django.core.management.base import BaseCommand
+from store.bulk import batches_by_id
+from store.catalog import (
+    COLLECTION_FIELDS,
+    FORMATS,
+    PRODUCT_FIELDS,
+    PROMOTION_FIELDS,
+    RowWriter,
+    catalog_path,
+)
+from store.models import Collection, Product, Promotion
+
+
+class Command(BaseCommand):
+    help = (
+        "Streams promotions, collections and products to CSV or JSON Lines files "
+        "in a directory, without loading the catalog in memory."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("directory")
+        parser.add_argument("--format", choices=FORMATS, default="csv")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        self.directory = options["directory"]
+        self.format = options["format"]
+        self.batch_size = options["batch_size"]
+
+        promotions = self.export(
+            "promotions", PROMOTION_FIELDS, Promotion.objects.values(*PROMOTION_FIELDS)
+        )
+        collections = self.export(
+            "collections",
+            COLLECTION_FIELDS,
+            Collection.objects.values(*COLLECTION_FIELDS),
+        )
+        products = self.export_products()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Exported {promotions} promotion(s), {collections} collection(s) "
+                f"and {products} product(s)."
+            )
+        )
+
+    def open(self, name):
+        path = catalog_path(self.directory, name, self.format)
+        return open(path, "w", newline="", encoding="utf-8")
+
+    def export(self, name, fields, rows):
+        exported = 0
+        with self.open(name) as file:
+            writer = RowWriter(file, self.format, fields)
+            for batch in batches_by_id(rows, self.batch_size):
+                for row in batch:
+                    writer.write(row)
+                exported += len(batch)
+        return exported
+
+    def export_products(self):
+        fields = [field for field in PRODUCT_FIELDS if field != "promotions"]
+        rows = Product.objects.values(*fields)
+
+        exported = 0
+        with self.open("products") as file:
+            writer = RowWriter(file, self.format, PRODUCT_FIELDS)
+            for batch in batches_by_id(rows, self.batch_size):
+                exported += self.write_products(writer, batch)
+        return exported
+
+    def write_products(self, writer, batch):
+        # One query per chunk for the promotions of all its products
+        promotions = {row["id"]: [] for row in batch}
+        links = (
+            Product.promotions.through.objects.filter(product_id__in=list(promotions))
+            .order_by("product_id", "promotion_id")
+            .values_list("product_id", "promotion_id")
+        )
+        for product_id, promotion_id in links:
+            promotions[product_id].append(promotion_id)
+
+        for row in batch:
+            writer.write({**row, "promotions": promotions[row["id"]]})
+        return len(batch)
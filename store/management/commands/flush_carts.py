@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from store import carts
+
+
+class Command(BaseCommand):
+    help = "Writes carts changed in the cache to the database (CART_STORAGE = 'cache')."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        if not carts.cache_enabled():
+            self.stdout.write("CART_STORAGE is not 'cache', nothing to flush.")
+            return
+
+        flushed = carts.flush_dirty_carts(batch_size=options["batch_size"])
+        if flushed is None:
+            self.stdout.write("Another flush_carts is running.")
+            return
+        self.stdout.write(self.style.SUCCESS(f"Flushed {flushed} cart(s)."))
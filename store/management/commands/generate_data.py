@@ -0,0 +1,352 @@
+import random
+import uuid
+from contextlib import contextmanager
+from datetime import date, datetime, time, timedelta, timezone
+from decimal import Decimal
+from itertools import islice
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max, OuterRef, Subquery
+from django.utils.text import slugify
+from store.bulk import reset_sequences
+from store.caching import bump_version
+from store.models import (
+    Cart,
+    CartItem,
+    Collection,
+    Customer,
+    Order,
+    OrderItem,
+    Product,
+    Review,
+)
+from store.search import index_products
+from tags.models import Tag, TaggedItem
+
+ADJECTIVES = [
+    "Amber", "Bold", "Classic", "Crisp", "Dark", "Deluxe", "Fresh", "Golden",
+    "Light", "Mild", "Organic", "Rich", "Rustic", "Smoked", "Spicy", "Sweet",
+    "Tangy", "Tender", "Vintage", "Wild",
+]  # fmt: skip
+NOUNS = [
+    "Almonds", "Bagel", "Basil", "Brie", "Butter", "Cheddar", "Chutney",
+    "Coffee", "Cookies", "Crackers", "Honey", "Jam", "Lentils", "Muffin",
+    "Olives", "Pasta", "Pepper", "Salsa", "Tea", "Walnuts",
+]  # fmt: skip
+FIRST_NAMES = [
+    "Alex", "Ana", "Ben", "Chen", "Dana", "Eli", "Fatima", "Grace", "Hugo",
+    "Ines", "Jon", "Kai", "Lena", "Malik", "Nora", "Omar", "Priya", "Ravi",
+    "Sara", "Tom",
+]  # fmt: skip
+LAST_NAMES = [
+    "Adams", "Brown", "Costa", "Diaz", "Evans", "Fischer", "Garcia", "Hansen",
+    "Ito", "Jones", "Khan", "Lopez", "Meyer", "Novak", "Okafor", "Park",
+    "Rossi", "Silva", "Tanaka", "Wong",
+]  # fmt: skip
+WORDS = [
+    "fresh", "daily", "imported", "local", "family", "recipe", "small",
+    "batch", "handmade", "perfect", "breakfast", "snack", "pantry", "gift",
+    "favourite", "farm", "roasted", "aged", "pack", "jar",
+]  # fmt: skip
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+@contextmanager
+def explicit_dates(*models):
+    """
+    bulk_create() fills auto_now and auto_now_add fields with the current
+    time, turn them off so the generated timestamps are kept.
+    """
+    fields = [
+        field
+        for model in models
+        for field in model._meta.concrete_fields
+        if getattr(field, "auto_now", False) or getattr(field, "auto_now_add", False)
+    ]
+    saved = [(field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, (auto_now, auto_now_add) in zip(fields, saved):
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def next_id(model):
+    return (model.objects.aggregate(Max("id"))["id__max"] or 0) + 1
+
+
+class Command(BaseCommand):
+    help = (
+        "Generates a reproducible synthetic dataset for load testing: "
+        "collections, products, users with their customers, orders, carts, "
+        "reviews and tags. The same --seed against the same database gives the "
+        "same rows. Rows are appended after the existing ones and inserted with "
+        "batched bulk_create(), so no signal handlers run; the search index, "
+        "product counts and cache versions are updated at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--products", type=int, default=10000)
+        parser.add_argument("--customers", type=int, default=10000)
+        parser.add_argument(
+            "--collections",
+            type=int,
+            help="Defaults to one per 1000 products, at least 10.",
+        )
+        parser.add_argument(
+            "--orders", type=int, help="Defaults to three per customer."
+        )
+        parser.add_argument("--carts", type=int, help="Defaults to one per customer.")
+        parser.add_argument("--reviews", type=int, help="Defaults to two per product.")
+        parser.add_argument(
+            "--tagged-items", type=int, help="Defaults to one per product."
+        )
+        parser.add_argument(
+            "--end-date",
+            type=date.fromisoformat,
+            default=date(2025, 1, 1),
+            help="Timestamps are spread over the year before this date.",
+        )
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        products = options["products"]
+        customers = options["customers"]
+        counts = {
+            "collections": self.default(
+                options["collections"], max(10, products // 1000)
+            ),
+            "orders": self.default(options["orders"], customers * 3),
+            "carts": self.default(options["carts"], customers),
+            "reviews": self.default(options["reviews"], products * 2),
+            "tagged_items": self.default(options["tagged_items"], products),
+        }
+        if counts["orders"] and not customers and not Customer.objects.exists():
+            raise CommandError("Orders need customers, pass --customers.")
+        if not products and not Product.objects.exists():
+            raise CommandError("There are no products, pass --products.")
+
+        self.random = random.Random(options["seed"])
+        self.batch_size = options["batch_size"]
+        end = datetime.combine(options["end_date"], time(), tzinfo=timezone.utc)
+        self.start, self.span = end - timedelta(days=365), 365 * 24 * 3600
+
+        with explicit_dates(Product, Order, Cart, Review):
+            self.generate_collections(counts["collections"])
+            self.generate_products(products)
+            self.generate_customers(customers)
+            self.product_ids = list(
+                Product.objects.order_by("id").values_list("id", flat=True)
+            )
+            self.generate_orders(counts["orders"])
+            self.generate_carts(counts["carts"])
+            self.generate_reviews(counts["reviews"])
+            self.generate_tagged_items(counts["tagged_items"])
+
+        # The explicit ids leave the sequences of these behind
+        reset_sequences(Collection, Product, get_user_model(), Customer, Order)
+
+        # Bulk inserts skip the signal handlers that keep these up to date
+        call_command("recount_products", stdout=self.stdout)
+        for model in [Product, Collection]:
+            bump_version(model)
+
+    def default(self, value, derived):
+        return derived if value is None else value
+
+    def timestamp(self):
+        return self.start + timedelta(seconds=self.random.randrange(self.span))
+
+    def insert(self, model, objects, after_batch=None):
+        inserted = 0
+        for batch in batched(objects, self.batch_size):
+            with transaction.atomic():
+                model.objects.bulk_create(batch)
+                if after_batch is not None:
+                    after_batch(batch)
+            inserted += len(batch)
+        self.stdout.write(f"Generated {inserted} {model._meta.verbose_name_plural}.")
+        return inserted
+
+    def generate_collections(self, count):
+        first = next_id(Collection)
+        self.insert(
+            Collection,
+            (
+                Collection(
+                    id=id,
+                    title=f"{self.random.choice(ADJECTIVES)} {self.random.choice(NOUNS)} {id}",
+                )
+                for id in range(first, first + count)
+            ),
+        )
+        self.collection_ids = list(
+            Collection.objects.order_by("id").values_list("id", flat=True)
+        )
+
+    def generate_products(self, count):
+        first = next_id(Product)
+
+        def products():
+            for id in range(first, first + count):
+                title = (
+                    f"{self.random.choice(ADJECTIVES)} {self.random.choice(NOUNS)} "
+                    f"{self.random.choice(NOUNS)} {id}"
+                )
+                yield Product(
+                    id=id,
+                    title=title,
+                    slug=slugify(title),
+                    description=" ".join(self.random.choices(WORDS, k=12)),
+                    unit_price=Decimal(self.random.randrange(100, 100000)) / 100,
+                    inventory=self.random.randrange(0, 100),
+                    collection_id=self.random.choice(self.collection_ids),
+                    last_update=self.timestamp(),
+                )
+
+        self.insert(Product, products(), after_batch=index_products)
+
+    def generate_customers(self, count):
+        User = get_user_model()
+        first = next_id(User)
+        # Hashing a password per user would take longer than everything else
+        password = make_password("password", salt="synthetic")
+        self.insert(
+            User,
+            (
+                User(
+                    id=id,
+                    username=f"user{id}",
+                    email=f"user{id}@example.com",
+                    password=password,
+                    first_name=self.random.choice(FIRST_NAMES),
+                    last_name=self.random.choice(LAST_NAMES),
+                    date_joined=self.timestamp(),
+                )
+                for id in range(first, first + count)
+            ),
+        )
+
+        # The post_save handler that creates them does not run for bulk_create()
+        first_customer = next_id(Customer)
+        self.insert(
+            Customer,
+            (
+                Customer(
+                    id=first_customer + offset,
+                    user_id=first + offset,
+                    phone=f"+1555{self.random.randrange(10**7):07d}",
+                    birth_date=date(1950, 1, 1)
+                    + timedelta(days=self.random.randrange(50 * 365)),
+                    membership=self.random.choices("BSG", weights=[8, 3, 1])[0],
+                )
+                for offset in range(count)
+            ),
+        )
+
+    def generate_orders(self, count):
+        customer_ids = list(
+            Customer.objects.order_by("id").values_list("id", flat=True)
+        )
+        first = next_id(Order)
+        order_ids = range(first, first + count)
+        self.insert(
+            Order,
+            (
+                Order(
+                    id=id,
+                    customer_id=self.random.choice(customer_ids),
+                    payment_status=self.random.choices("CPF", weights=[90, 8, 2])[0],
+                    placed_at=self.timestamp(),
+                )
+                for id in order_ids
+            ),
+        )
+
+        first_item = next_id(OrderItem)
+        self.insert(
+            OrderItem,
+            (
+                OrderItem(
+                    order_id=order_id,
+                    product_id=product_id,
+                    quantity=self.random.randint(1, 5),
+                    # Set to the product's price below
+                    unit_price=0,
+                )
+                for order_id in order_ids
+                for product_id in self.sample_products(1, 5)
+            ),
+        )
+        OrderItem.objects.filter(id__gte=first_item).update(
+            unit_price=Subquery(
+                Product.objects.filter(pk=OuterRef("product_id")).values("unit_price")
+            )
+        )
+
+    def generate_carts(self, count):
+        cart_ids = [
+            uuid.UUID(int=self.random.getrandbits(128), version=4) for _ in range(count)
+        ]
+        self.insert(Cart, (Cart(id=id, created_at=self.timestamp()) for id in cart_ids))
+        self.insert(
+            CartItem,
+            (
+                CartItem(
+                    cart_id=cart_id,
+                    product_id=product_id,
+                    quantity=self.random.randint(1, 5),
+                )
+                for cart_id in cart_ids
+                for product_id in self.sample_products(0, 4)
+            ),
+        )
+
+    def generate_reviews(self, count):
+        self.insert(
+            Review,
+            (
+                Review(
+                    product_id=self.random.choice(self.product_ids),
+                    name=f"{self.random.choice(FIRST_NAMES)} {self.random.choice(LAST_NAMES)[0]}.",
+                    description=" ".join(self.random.choices(WORDS, k=20)),
+                    date=self.timestamp().date(),
+                )
+                for _ in range(count)
+            ),
+        )
+
+    def generate_tagged_items(self, count):
+        if not count:
+            return
+        if not Tag.objects.exists():
+            self.insert(Tag, (Tag(label=word) for word in WORDS))
+        tag_ids = list(Tag.objects.order_by("id").values_list("id", flat=True))
+        content_type = ContentType.objects.get_for_model(Product)
+        self.insert(
+            TaggedItem,
+            (
+                TaggedItem(
+                    tag_id=self.random.choice(tag_ids),
+                    content_type=content_type,
+                    object_id=self.random.choice(self.product_ids),
+                )
+                for _ in range(count)
+            ),
+        )
+
+    def sample_products(self, least, most):
+        size = min(self.random.randint(least, most), len(self.product_ids))
+        return self.random.sample(self.product_ids, size)
@@ -0,0 +1,170 @@
+from decimal import Decimal, InvalidOperation
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.text import slugify
+from store.bulk import reset_sequences
+from store.caching import bump_version
+from store.catalog import FORMATS, catalog_path, read_rows
+from store.models import Collection, Product, Promotion
+from store.search import index_products
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports promotions, collections and products from the CSV or JSON Lines "
+        "files written by export_catalog. Rows are streamed and written in "
+        "batches, existing ids are updated and new ones created. Products may "
+        "name their collection by id (collection_id) or by title (collection)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("directory")
+        parser.add_argument("--format", choices=FORMATS, default="csv")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        self.directory = options["directory"]
+        self.format = options["format"]
+        self.batch_size = options["batch_size"]
+
+        # Featured products may not exist until the products are imported
+        self.featured_products = {}
+
+        promotions = self.load("promotions", Promotion, self.parse_promotion)
+        self.collection_ids = set(Collection.objects.values_list("id", flat=True))
+        self.collection_titles = dict(Collection.objects.values_list("title", "id"))
+        collections = self.load("collections", Collection, self.parse_collection)
+        self.promotion_ids = set(Promotion.objects.values_list("id", flat=True))
+        products = self.load("products", Product, self.parse_product)
+
+        for collection_id, product_id in self.featured_products.items():
+            Collection.objects.filter(pk=collection_id).update(
+                featured_product_id=product_id
+            )
+
+        # Rows were inserted with explicit ids
+        reset_sequences(Promotion, Collection, Product)
+
+        # Bulk writes skip the signal handlers that keep these up to date
+        call_command("recount_products", stdout=self.stdout)
+        for model in [Product, Collection, Promotion]:
+            bump_version(model)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {promotions} promotion(s), {collections} collection(s) "
+                f"and {products} product(s)."
+            )
+        )
+
+    def load(self, name, model, parse):
+        path = catalog_path(self.directory, name, self.format)
+        if not path.exists():
+            return 0
+
+        # Rows without an id are appended after the current ones
+        self.next_id = (model.objects.aggregate(Max("id"))["id__max"] or 0) + 1
+        imported, batch = 0, []
+        for line_number, row in read_rows(path, self.format):
+            try:
+                batch.append(parse(row))
+            except (KeyError, TypeError, ValueError, InvalidOperation) as error:
+                raise CommandError(f"{path}, line {line_number}: {error!r}")
+            if len(batch) == self.batch_size:
+                imported += self.save(model, batch)
+                batch = []
+        if batch:
+            imported += self.save(model, batch)
+        return imported
+
+    def get_id(self, row):
+        if row.get("id") is not None:
+            id = int(row["id"])
+        else:
+            id = self.next_id
+        self.next_id = max(self.next_id, id + 1)
+        return id
+
+    def parse_promotion(self, row):
+        return Promotion(
+            id=self.get_id(row),
+            description=row["description"],
+            discount=float(row["discount"]),
+        )
+
+    def parse_collection(self, row):
+        collection = Collection(id=self.get_id(row), title=row["title"])
+        if row.get("featured_product_id") is not None:
+            self.featured_products[collection.id] = int(row["featured_product_id"])
+        self.collection_ids.add(collection.id)
+        self.collection_titles[collection.title] = collection.id
+        return collection
+
+    def parse_product(self, row):
+        if row.get("collection_id") is not None:
+            collection_id = int(row["collection_id"])
+            if collection_id not in self.collection_ids:
+                raise ValueError(f"Unknown collection id {collection_id}")
+        else:
+            collection_id = self.collection_titles.get(row.get("collection"))
+            if collection_id is None:
+                raise ValueError(f"Unknown collection {row.get('collection')!r}")
+
+        promotions = [int(id) for id in row.get("promotions") or []]
+        unknown = set(promotions) - self.promotion_ids
+        if unknown:
+            raise ValueError(f"Unknown promotion id(s) {sorted(unknown)}")
+
+        product = Product(
+            id=self.get_id(row),
+            title=row["title"],
+            slug=row.get("slug") or slugify(row["title"]) or "-",
+            description=row.get("description"),
+            unit_price=Decimal(str(row["unit_price"])),
+            inventory=int(row["inventory"]),
+            collection_id=collection_id,
+            # bulk_update() does not apply auto_now
+            last_update=timezone.now(),
+        )
+        product.promotion_ids = promotions
+        return product
+
+    def save(self, model, batch):
+        fields = [
+            field.name
+            for field in model._meta.concrete_fields
+            if not field.primary_key
+            and field.name not in ("featured_product", "products_count")
+        ]
+        existing = set(
+            model.objects.filter(id__in=[obj.id for obj in batch]).values_list(
+                "id", flat=True
+            )
+        )
+
+        with transaction.atomic():
+            model.objects.bulk_create([obj for obj in batch if obj.id not in existing])
+            model.objects.bulk_update(
+                [obj for obj in batch if obj.id in existing], fields
+            )
+            if model is Product:
+                self.save_product_relations(batch)
+        return len(batch)
+
+    def save_product_relations(self, products):
+        Through = Product.promotions.through
+        Through.objects.filter(
+            product_id__in=[product.id for product in products]
+        ).delete()
+        Through.objects.bulk_create(
+            [
+                Through(product_id=product.id, promotion_id=promotion_id)
+                for product in products
+                for promotion_id in product.promotion_ids
+            ],
+            ignore_conflicts=True,
+        )
+        index_products(products)
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from store.bulk import batches_by_id
+from store.models import Product
+from store.search import index_products
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the product search index from product titles and descriptions."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        products = Product.objects.only("id", "title", "description")
+
+        indexed = 0
+        for batch in batches_by_id(products, options["batch_size"]):
+            index_products(batch)
+            indexed += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} product(s)."))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from store.caching import bump_version
+from store.models import Collection, Product
+
+
+class Command(BaseCommand):
+    help = "Recomputes Collection.products_count from the product table."
+
+    def handle(self, *args, **options):
+        counts = (
+            Product.objects.filter(collection=OuterRef("pk"))
+            .order_by()
+            .values("collection")
+            .annotate(count=Count("id"))
+            .values("count")
+        )
+        updated = Collection.objects.update(
+            products_count=Coalesce(Subquery(counts), 0)
+        )
+        bump_version(Collection)
+        self.stdout.write(self.style.SUCCESS(f"Recounted {updated} collection(s)."))
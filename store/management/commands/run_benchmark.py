@@ -0,0 +1,346 @@
+import json
+import math
+import random
+import time
+from collections import defaultdict
+from pathlib import Path
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import resolve
+from core.serializers import TokenObtainPairSerializer
+from store.models import Collection, Product
+
+BENCHMARKS_DIR = Path(settings.BASE_DIR) / "benchmarks"
+MIN_SAMPLES = 20
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class TestClientTarget:
+    """Requests through Django's test client, in this process and database."""
+
+    def __init__(self):
+        # Outside INTERNAL_IPS, so the debug toolbar stays out of the numbers
+        self.client = Client(HTTP_HOST="localhost", REMOTE_ADDR="192.0.2.1")
+        # A cache of its own, cold on every run and gone afterwards, rather
+        # than clearing the cache the running servers share
+        self.cache_settings = override_settings(
+            CACHES={
+                "default": {
+                    "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                    "LOCATION": "benchmark",
+                }
+            }
+        )
+        self.cache_settings.enable()
+
+    def close(self):
+        self.cache_settings.disable()
+
+    def send(self, method, path, data, headers):
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            start = time.perf_counter()
+            response = self.client.generic(
+                method,
+                path,
+                json.dumps(data) if data is not None else "",
+                content_type="application/json",
+                **{
+                    "HTTP_" + key.upper().replace("-", "_"): value
+                    for key, value in headers.items()
+                },
+            )
+            elapsed = time.perf_counter() - start
+        return response.status_code, response.content, elapsed, counter.count
+
+    def query_totals(self):
+        return None
+
+
+class LiveServerTarget:
+    """
+    Requests over HTTP to a running server. Query counts come from its
+    /metrics/ endpoint (see storefront/metrics.py) when it is reachable.
+    """
+
+    def __init__(self, url):
+        import requests
+
+        self.url = url.rstrip("/")
+        self.session = requests.Session()
+
+    def send(self, method, path, data, headers):
+        start = time.perf_counter()
+        response = self.session.request(
+            method, self.url + path, json=data, headers=headers
+        )
+        elapsed = time.perf_counter() - start
+        return response.status_code, response.content, elapsed, None
+
+    def close(self):
+        self.session.close()
+
+    def query_totals(self):
+        from prometheus_client.parser import text_string_to_metric_families
+
+        response = self.session.get(self.url + "/metrics/")
+        if response.status_code != 200:
+            return None
+        totals = defaultdict(float)
+        for family in text_string_to_metric_families(response.text):
+            if family.name == "storefront_request_queries":
+                for sample in family.samples:
+                    if sample.name.endswith("_sum"):
+                        totals[sample.labels["view"]] += sample.value
+        return totals
+
+
+def percentile(values, fraction):
+    # Nearest rank
+    values = sorted(values)
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Replays a recorded request mix (benchmarks/requests.jsonl) against a "
+        "seeded database and reports latency percentiles, throughput and queries "
+        "per request for each endpoint. Fails when an endpoint regressed against "
+        "the saved baseline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--mix", default=str(BENCHMARKS_DIR / "requests.jsonl"))
+        parser.add_argument("--baseline", default=str(BENCHMARKS_DIR / "baseline.json"))
+        parser.add_argument("--requests", type=int, default=1000)
+        parser.add_argument("--warmup", type=int, default=50)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--url",
+            help="Base URL of a running server, otherwise the test client is used.",
+        )
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.2,
+            help="Allowed p95 latency increase over the baseline (0.2 = 20%%).",
+        )
+        parser.add_argument(
+            "--save-baseline",
+            action="store_true",
+            help="Write the results as the new baseline instead of comparing.",
+        )
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options["seed"])
+        mix = self.load_mix(options["mix"])
+        if options["url"]:
+            target = LiveServerTarget(options["url"])
+        else:
+            target = TestClientTarget()
+        try:
+            self.run(target, mix, options)
+        finally:
+            target.close()
+
+    def run(self, target, mix, options):
+        self.fixtures = self.get_fixtures(target)
+
+        for _ in range(options["warmup"]):
+            self.send(target, self.pick(mix))
+
+        samples = defaultdict(list)
+        queries = defaultdict(list)
+        views = {}
+        totals_before = target.query_totals()
+        started = time.perf_counter()
+        for _ in range(options["requests"]):
+            entry = self.pick(mix)
+            path, elapsed, count = self.send(target, entry)
+            samples[entry["name"]].append(elapsed)
+            if count is not None:
+                queries[entry["name"]].append(count)
+            views[entry["name"]] = resolve(path.split("?")[0]).view_name
+        duration = time.perf_counter() - started
+
+        totals_after = target.query_totals()
+        if totals_before is not None and totals_after is not None:
+            # Over HTTP only per view totals are known
+            for name in samples:
+                view = views[name]
+                requests = sum(len(samples[n]) for n in samples if views[n] == view)
+                spent = totals_after[view] - totals_before[view]
+                queries[name] = [spent / requests]
+
+        results = {
+            "throughput": options["requests"] / duration,
+            "endpoints": {
+                name: {
+                    "count": len(values),
+                    "p50": percentile(values, 0.50) * 1000,
+                    "p95": percentile(values, 0.95) * 1000,
+                    "p99": percentile(values, 0.99) * 1000,
+                    "queries": (
+                        sum(queries[name]) / len(queries[name])
+                        if queries[name]
+                        else None
+                    ),
+                }
+                for name, values in sorted(samples.items())
+            },
+        }
+
+        baseline_path = Path(options["baseline"])
+        baseline = None
+        if not options["save_baseline"] and baseline_path.exists():
+            baseline = json.loads(baseline_path.read_text())
+        regressions = self.report(results, baseline, options["tolerance"])
+
+        if options["save_baseline"]:
+            baseline_path.write_text(json.dumps(results, indent=2) + "\n")
+            self.stdout.write(self.style.SUCCESS(f"Saved baseline {baseline_path}"))
+        elif regressions:
+            raise CommandError(
+                f"{len(regressions)} endpoint(s) regressed: {', '.join(regressions)}"
+            )
+
+    def load_mix(self, path):
+        with open(path, encoding="utf-8") as file:
+            mix = [json.loads(line) for line in file if line.strip()]
+        if not mix:
+            raise CommandError(f"{path} has no requests")
+        self.weights = [entry.get("weight", 1) for entry in mix]
+        return mix
+
+    def pick(self, mix):
+        return self.random.choices(mix, weights=self.weights)[0]
+
+    def get_fixtures(self, target):
+        User = get_user_model()
+        product_ids = list(
+            Product.objects.order_by("id").values_list("id", flat=True)[:1000]
+        )
+        collection_ids = list(
+            Collection.objects.order_by("id").values_list("id", flat=True)
+        )
+        admin = User.objects.filter(is_staff=True).order_by("id").first()
+        customer = (
+            User.objects.filter(is_staff=False, customer__isnull=False)
+            .order_by("id")
+            .first()
+        )
+        if not product_ids or not collection_ids or admin is None or customer is None:
+            raise CommandError(
+                "The database needs products, collections, a staff user and a "
+                "customer, seed it first."
+            )
+
+        titles = Product.objects.filter(id__in=product_ids[:100]).values_list(
+            "title", flat=True
+        )
+        fixtures = {
+            "product_ids": product_ids,
+            "collection_ids": collection_ids,
+            "search_terms": sorted({title.split()[0][:4].lower() for title in titles}),
+            # As issued at login, with the claims StatelessJWTAuthentication
+            # and store.customers read
+            "tokens": {
+                "admin": self.access_token(admin),
+                "customer": self.access_token(customer),
+            },
+        }
+
+        # A cart with a few items for the cart endpoints, set up untimed
+        status, content, _, _ = target.send("POST", "/store/cart/", {}, {})
+        if status != 201:
+            raise CommandError(f"Could not create a cart ({status})")
+        fixtures["cart_id"] = json.loads(content)["id"]
+        for product_id in self.random.sample(product_ids, min(3, len(product_ids))):
+            target.send(
+                "POST",
+                f"/store/cart/{fixtures['cart_id']}/cartitems/",
+                {"product": product_id, "quantity": 1},
+                {},
+            )
+        return fixtures
+
+    def fill(self, template):
+        return template.format(
+            product_id=self.random.choice(self.fixtures["product_ids"]),
+            collection_id=self.random.choice(self.fixtures["collection_ids"]),
+            search_term=self.random.choice(self.fixtures["search_terms"]),
+            cart_id=self.fixtures["cart_id"],
+        )
+
+    def access_token(self, user):
+        return str(TokenObtainPairSerializer.get_token(user).access_token)
+
+    def send(self, target, entry):
+        path = self.fill(entry["path"])
+        data = entry.get("data")
+        if data is not None:
+            data = {
+                key: self.fill(value) if isinstance(value, str) else value
+                for key, value in data.items()
+            }
+        headers = {}
+        if entry.get("user"):
+            headers["Authorization"] = "JWT " + self.fixtures["tokens"][entry["user"]]
+
+        status, _, elapsed, count = target.send(entry["method"], path, data, headers)
+        if status >= 400:
+            raise CommandError(f"{entry['method']} {path} returned {status}")
+        return path, elapsed, count
+
+    def report(self, results, baseline, tolerance):
+        self.stdout.write(
+            f"{'endpoint':<28} {'count':>6} {'p50 ms':>8} {'p95 ms':>8} "
+            f"{'p99 ms':>8} {'queries':>8}  vs baseline"
+        )
+        regressions = []
+        for name, result in results["endpoints"].items():
+            queries = result["queries"]
+            queries = f"{queries:.1f}" if queries is not None else "-"
+            line = (
+                f"{name:<28} {result['count']:>6} {result['p50']:>8.2f} "
+                f"{result['p95']:>8.2f} {result['p99']:>8.2f} {queries:>8}"
+            )
+            base = (baseline or {}).get("endpoints", {}).get(name)
+            if base is not None:
+                problems = self.compare(result, base, tolerance)
+                line += "  " + ("; ".join(problems) if problems else "ok")
+                if problems:
+                    regressions.append(name)
+            self.stdout.write(line)
+
+        self.stdout.write(f"Throughput: {results['throughput']:.1f} requests/s")
+        return regressions
+
+    def compare(self, result, base, tolerance):
+        problems = []
+        # The p95 of a handful of samples, or a change below a millisecond,
+        # is noise
+        if (
+            min(result["count"], base["count"]) >= MIN_SAMPLES
+            and result["p95"] > base["p95"] * (1 + tolerance)
+            and result["p95"] - base["p95"] > 1
+        ):
+            problems.append(f"p95 {base['p95']:.2f} -> {result['p95']:.2f} ms")
+        if (
+            result["queries"] is not None
+            and base.get("queries") is not None
+            and result["queries"] > base["queries"] + 0.5
+        ):
+            problems.append(f"queries {base['queries']:.1f} -> {result['queries']:.1f}")
+        return problems
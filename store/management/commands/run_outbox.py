@@ -0,0 +1,41 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from store import outbox
+
+
+class Command(BaseCommand):
+    help = "Delivers pending outbox events (order_created, ...) to their receivers."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--workers", type=int, default=4)
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=1.0,
+            help="Seconds to wait when there is nothing to deliver.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once no event is pending instead of polling.",
+        )
+
+    def handle(self, *args, **options):
+        worker = outbox.worker_name()
+
+        with outbox.OutboxPool(options["workers"]) as pool:
+            while True:
+                close_old_connections()
+                events = outbox.claim_events(worker, options["batch_size"])
+                if events:
+                    results = outbox.process_batch(events, pool)
+                    self.stdout.write(
+                        f"Delivered {results.count(True)} event(s),"
+                        f" {results.count(False)} failed."
+                    )
+                elif options["once"]:
+                    break
+                else:
+                    time.sleep(options["poll_interval"])
@@ -0,0 +1,63 @@
+# Generated by Django 4.2.3 on 2026-10-18 04:42
+
+import re
+from django.db import migrations, models
+import django.db.models.deletion
+import store.models
+
+# Copied from store.search as it was when the index was added, so later
+# changes to tokenizing don't change what this migration builds
+TOKEN_PATTERN = re.compile(r"\w+")
+MAX_TOKEN_LENGTH = 64
+TITLE_WEIGHT = 3
+DESCRIPTION_WEIGHT = 1
+
+
+def tokenize(text):
+    if not text:
+        return []
+    return [token[:MAX_TOKEN_LENGTH] for token in TOKEN_PATTERN.findall(text.lower())]
+
+
+def build_search_index(apps, schema_editor):
+    Product = apps.get_model("store", "Product")
+    ProductSearchToken = apps.get_model("store", "ProductSearchToken")
+
+    tokens = []
+    for product in Product.objects.only("id", "title", "description").iterator():
+        weights = {}
+        for token in tokenize(product.title):
+            weights[token] = weights.get(token, 0) + TITLE_WEIGHT
+        for token in tokenize(product.description):
+            weights[token] = weights.get(token, 0) + DESCRIPTION_WEIGHT
+        tokens.extend(
+            ProductSearchToken(product_id=product.id, term=term, weight=weight)
+            for term, weight in weights.items()
+        )
+        if len(tokens) >= 5000:
+            ProductSearchToken.objects.bulk_create(tokens)
+            tokens = []
+    ProductSearchToken.objects.bulk_create(tokens)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0004_collection_products_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', store.models.BinaryCharField(max_length=64)),
+                ('weight', models.PositiveIntegerField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='store.product')),
+            ],
+            options={
+                'unique_together': {('term', 'product')},
+            },
+        ),
+        migrations.RunPython(build_search_index, migrations.RunPython.noop),
+    ]
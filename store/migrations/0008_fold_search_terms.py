@@ -0,0 +1,61 @@
+# Generated by Django 4.2.3 on 2026-10-18 06:10
+
+import re
+import unicodedata
+from django.db import migrations
+
+# Copied from store.search as it was when terms were first folded, so later
+# changes to tokenizing don't change what this migration builds
+TOKEN_PATTERN = re.compile(r"\w+")
+MAX_TOKEN_LENGTH = 64
+TITLE_WEIGHT = 3
+DESCRIPTION_WEIGHT = 1
+
+
+def fold(text):
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def tokenize(text):
+    if not text:
+        return []
+    return [token[:MAX_TOKEN_LENGTH] for token in TOKEN_PATTERN.findall(fold(text))]
+
+
+def reindex_folded_products(apps, schema_editor):
+    """Reindexes the products that have a term with accents or capitals."""
+    Product = apps.get_model("store", "Product")
+    ProductSearchToken = apps.get_model("store", "ProductSearchToken")
+
+    product_ids = {
+        product_id
+        for term, product_id in ProductSearchToken.objects.values_list(
+            "term", "product_id"
+        ).iterator()
+        if fold(term) != term
+    }
+    for product in Product.objects.filter(id__in=product_ids).only(
+        "id", "title", "description"
+    ):
+        weights = {}
+        for token in tokenize(product.title):
+            weights[token] = weights.get(token, 0) + TITLE_WEIGHT
+        for token in tokenize(product.description):
+            weights[token] = weights.get(token, 0) + DESCRIPTION_WEIGHT
+        ProductSearchToken.objects.filter(product_id=product.id).delete()
+        ProductSearchToken.objects.bulk_create(
+            ProductSearchToken(product_id=product.id, term=term, weight=weight)
+            for term, weight in weights.items()
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0007_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(reindex_folded_products, migrations.RunPython.noop),
+    ]
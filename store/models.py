@@ -1,4 +1,8 @@
-from django.db import models
+from decimal import Decimal
+from django.db import connections, models, router, transaction
+from django.db.models import Case, ExpressionWrapper, F, Prefetch, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from uuid import uuid4
 from django.core.validators import MinValueValidator
 from django.conf import settings
@@ -15,14 +19,60 @@ class Collection(models.Model):
     featured_product = models.ForeignKey(
         "Product", on_delete=models.SET_NULL, null=True, related_name="+"
     )
+    # Maintained by the product signal handlers in store.signals.handlers,
+    # `manage.py recount_products` recomputes it if it ever drifts.
+    products_count = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self) -> str:
         return self.title
 
+    def save(self, *args, **kwargs):
+        # Never write back a products_count that was read before products were
+        # added or removed in the meantime.
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != "products_count"
+            ]
+        super().save(*args, **kwargs)
+
     class Meta:
         ordering = ["title"]
 
 
+# Multiplier applied to unit_price for the tax inclusive price
+TAX_RATE = Decimal("1.18")
+
+
+class ProductQuerySet(models.QuerySet):
+    def reserve_inventory(self, quantities):
+        """
+        Takes {product_id: quantity} out of inventory with a single UPDATE
+        that only touches products with enough stock. Returns the number of
+        products updated, fewer than len(quantities) means some line could
+        not be filled and the caller should roll back.
+        """
+        requested = Case(
+            *[
+                When(id=product_id, then=Value(quantity))
+                for product_id, quantity in quantities.items()
+            ],
+            output_field=models.IntegerField(),
+        )
+        return self.filter(id__in=list(quantities), inventory__gte=requested).update(
+            inventory=F("inventory") - requested
+        )
+
+    def with_price_with_tax(self):
+        return self.annotate(
+            price_with_tax=ExpressionWrapper(
+                F("unit_price") * Value(TAX_RATE),
+                output_field=models.DecimalField(max_digits=9, decimal_places=4),
+            )
+        )
+
+
 class Product(models.Model):
     title = models.CharField(max_length=255)
     slug = models.SlugField(default="-", null=True)
@@ -39,11 +89,73 @@ class Product(models.Model):
     )
     promotions = models.ManyToManyField(Promotion, blank=True)
 
+    objects = ProductQuerySet.as_manager()
+
     def __str__(self) -> str:
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        product = super().from_db(db, field_names, values)
+        # Remember which collection the row was loaded with, so that moving the
+        # product can be reflected in Collection.products_count, and the
+        # searchable text, so saves that don't touch it skip reindexing.
+        product._loaded_collection_id = product.__dict__.get("collection_id")
+        product._loaded_search_text = (
+            product.__dict__.get("title"),
+            product.__dict__.get("description"),
+        )
+        return product
+
+    def save(self, *args, **kwargs):
+        # The post_save handler adjusts Collection.products_count, keep both
+        # writes in one transaction.
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     class Meta:
         ordering = ["title"]
+        indexes = [
+            # ProductFilter, a collection within a price range
+            models.Index(fields=["collection", "unit_price"]),
+            # KeysetPagination cursors, default and ?ordering=unit_price
+            models.Index(fields=["title", "id"]),
+            models.Index(fields=["unit_price", "id"]),
+        ]
+
+
+class BinaryCharField(models.CharField):
+    """
+    A CharField compared byte for byte on every backend, SQLite's default.
+    LIKE 'prefix%' can then range-scan an index on it, and only identical
+    strings collide in a unique constraint.
+    """
+
+    collations = {"mysql": "utf8mb4_bin", "postgresql": "C"}
+
+    def db_parameters(self, connection):
+        params = super().db_parameters(connection)
+        if self.db_collation is None:
+            params["collation"] = self.collations.get(connection.vendor)
+        return params
+
+
+class ProductSearchToken(models.Model):
+    """
+    Inverted index over product title and description, maintained by
+    store.search. One row per (term, product) with the term's weight, terms
+    are lowercased and stripped of accents by store.search.fold() rather
+    than by the database's collation.
+    """
+
+    term = BinaryCharField(max_length=64)
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="search_tokens"
+    )
+    weight = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = [["term", "product"]]
 
 
 class Customer(models.Model):
@@ -109,6 +221,8 @@ class Order(models.Model):
 
     class Meta:
         permissions = [("cancel_order", "Can cancel order")]
+        # OrderFilter and the export, orders placed within a period
+        indexes = [models.Index(fields=["placed_at"])]
 
 
 class OrderItem(models.Model):
@@ -126,19 +240,95 @@ class Address(models.Model):
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
 
 
+class CartQuerySet(models.QuerySet):
+    def with_totals(self):
+        """
+        Annotates `total_cart_value` and prefetches the items with their
+        `total_price` and products with their `price_with_tax`.
+        """
+        line_total = ExpressionWrapper(
+            F("cartitems__quantity") * F("cartitems__product__unit_price"),
+            output_field=models.DecimalField(max_digits=12, decimal_places=2),
+        )
+        return self.annotate(
+            total_cart_value=Coalesce(
+                Sum(line_total),
+                Value(Decimal(0)),
+                output_field=models.DecimalField(max_digits=12, decimal_places=2),
+            )
+        ).prefetch_related(
+            Prefetch(
+                "cartitems",
+                queryset=CartItem.objects.with_total_price().prefetch_related(
+                    Prefetch("product", queryset=Product.objects.with_price_with_tax())
+                ),
+            )
+        )
+
+
 class Cart(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid4)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    objects = CartQuerySet.as_manager()
 
     def __str__(self) -> str:
         return str(self.id)
 
 
+class CartItemQuerySet(models.QuerySet):
+    def add_quantity(self, cart_id, product_id, quantity):
+        """
+        Adds `quantity` of a product to a cart with a single
+        INSERT ... ON CONFLICT / ON DUPLICATE KEY UPDATE, so concurrent adds
+        of the same product neither lose increments nor hit unique_together.
+        Returns the resulting item.
+        """
+        db = router.db_for_write(self.model)
+        connection = connections[db]
+        quote = connection.ops.quote_name
+        opts = self.model._meta
+        table = quote(opts.db_table)
+        cart = quote(opts.get_field("cart").column)
+        product = quote(opts.get_field("product").column)
+        column = quote(opts.get_field("quantity").column)
+
+        sql = f"INSERT INTO {table} ({cart}, {product}, {column}) VALUES (%s, %s, %s)"
+        if connection.vendor == "mysql":
+            sql += f" ON DUPLICATE KEY UPDATE {column} = {column} + VALUES({column})"
+        else:
+            # SQLite >= 3.24 and PostgreSQL
+            sql += (
+                f" ON CONFLICT ({cart}, {product})"
+                f" DO UPDATE SET {column} = {table}.{column} + excluded.{column}"
+            )
+
+        params = [
+            opts.get_field("cart").get_db_prep_value(cart_id, connection),
+            product_id,
+            quantity,
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+        return self.using(db).get(cart_id=cart_id, product_id=product_id)
+
+    def with_total_price(self):
+        return self.annotate(
+            total_price=ExpressionWrapper(
+                F("quantity") * F("product__unit_price"),
+                output_field=models.DecimalField(max_digits=12, decimal_places=2),
+            )
+        )
+
+
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name="cartitems")
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveSmallIntegerField()
 
+    objects = CartItemQuerySet.as_manager()
+
     class Meta:
         unique_together = [["cart", "product"]]
 
@@ -148,3 +338,24 @@ class Review(models.Model):
     name = models.CharField(max_length=255)
     description = models.TextField()
     date = models.DateField(auto_now_add=True)
+
+
+class OutboxEvent(models.Model):
+    """
+    An event written in the same transaction as the change it describes and
+    delivered to its signal receivers afterwards by `manage.py run_outbox`,
+    see store.outbox.
+    """
+
+    name = models.CharField(max_length=255)
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    available_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    claimed_by = models.CharField(max_length=255, null=True)
+    claimed_until = models.DateTimeField(null=True)
+    processed_at = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["processed_at", "available_at"])]
@@ -0,0 +1,126 @@
+"""
+Transactional outbox. Checkout stores an OutboxEvent instead of sending
+order_created on the request thread; `manage.py run_outbox` claims pending
+events in batches and sends them from a thread pool, retrying failures with
+exponential backoff. Delivery is at least once, and a retry sends the
+signal to every receiver again, so receivers must be idempotent.
+"""
+
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.db import close_old_connections, connections
+from django.db.models import Q
+from django.utils import timezone
+from .models import Order, OutboxEvent
+from .signals import order_created
+
+ORDER_CREATED = "order_created"
+
+MAX_ATTEMPTS = 10
+MAX_RETRY_DELAY = 60 * 60
+# A claimed event whose worker died becomes available again after this
+CLAIM_TIMEOUT = timedelta(minutes=5)
+# How long a shutting down pool waits for its threads to close their
+# connections
+CLOSE_TIMEOUT = 30
+
+
+def enqueue(name, **payload):
+    return OutboxEvent.objects.create(name=name, payload=payload)
+
+
+def send_order_created(payload):
+    from .serializers import OrderCreateSerializer
+
+    order = Order.objects.get(pk=payload["order_id"])
+    return order_created.send_robust(OrderCreateSerializer, order=order)
+
+
+HANDLERS = {
+    ORDER_CREATED: send_order_created,
+}
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claim_events(worker, batch_size):
+    now = timezone.now()
+    claimable = Q(processed_at__isnull=True, attempts__lt=MAX_ATTEMPTS) & (
+        Q(claimed_until__isnull=True) | Q(claimed_until__lt=now)
+    )
+    ids = list(
+        OutboxEvent.objects.filter(claimable, available_at__lte=now)
+        .order_by("id")
+        .values_list("id", flat=True)[:batch_size]
+    )
+    # Another worker may have claimed some of these in between, the
+    # conditional update only hands us the ones still free.
+    OutboxEvent.objects.filter(claimable, id__in=ids).update(
+        claimed_by=worker, claimed_until=now + CLAIM_TIMEOUT
+    )
+    return list(OutboxEvent.objects.filter(id__in=ids, claimed_by=worker))
+
+
+def process_event(event):
+    # Like at the start of a request: reuses the thread's connection up to
+    # CONN_MAX_AGE and drops it if it broke
+    close_old_connections()
+    try:
+        for receiver, response in HANDLERS[event.name](event.payload):
+            if isinstance(response, Exception):
+                raise response
+    except Exception as exc:
+        attempts = event.attempts + 1
+        delay = min(2**attempts, MAX_RETRY_DELAY)
+        OutboxEvent.objects.filter(pk=event.pk).update(
+            attempts=attempts,
+            last_error=repr(exc),
+            available_at=timezone.now() + timedelta(seconds=delay),
+            claimed_by=None,
+            claimed_until=None,
+        )
+        return False
+    else:
+        OutboxEvent.objects.filter(pk=event.pk).update(
+            processed_at=timezone.now(), claimed_by=None, claimed_until=None
+        )
+        return True
+
+
+def process_batch(events, pool: ThreadPoolExecutor):
+    return list(pool.map(process_event, events))
+
+
+class OutboxPool(ThreadPoolExecutor):
+    """
+    Sends events from `max_workers` threads, each keeping its own database
+    connection, and closes those connections when it shuts down.
+    """
+
+    def __init__(self, max_workers):
+        super().__init__(max_workers=max_workers)
+        self.workers = max_workers
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        if wait and not cancel_futures:
+            self.close_connections()
+        super().shutdown(wait=wait, cancel_futures=cancel_futures)
+
+    def close_connections(self):
+        # Every task waits for all the others, so each runs on its own thread
+        barrier = threading.Barrier(self.workers, timeout=CLOSE_TIMEOUT)
+
+        def close():
+            try:
+                barrier.wait()
+            except threading.BrokenBarrierError:
+                pass
+            connections.close_all()
+
+        for future in [self.submit(close) for _ in range(self.workers)]:
+            future.result()
@@ -1,4 +1,344 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import json
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist
+from django.core.paginator import InvalidPage, Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
 
 class DefaultPagination(PageNumberPagination):
-    page_size = 10
\ No newline at end of file
+    page_size = 10
+
+    async def aget_page_queryset(self, queryset, request, view=None):
+        """
+        paginate_queryset() up to evaluating the page, counting with acount().
+        Returns the page's unevaluated slice, to be evaluated by the caller
+        and passed to finish_page(), or None if the list is not paginated.
+        """
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        paginator = self.django_paginator_class(queryset, page_size)
+        # Set ahead of the cached property, which would count synchronously
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            msg = self.invalid_page_message.format(
+                page_number=page_number, message=str(exc)
+            )
+            raise NotFound(msg)
+
+        if paginator.num_pages > 1 and self.template is not None:
+            self.display_page_controls = True
+
+        self.request = request
+        return self.page.object_list
+
+    def finish_page(self, rows):
+        self.page.object_list = rows
+        return rows
+
+
+class KeysetPagination(BasePagination):
+    """
+    Paginates on an (ordering key, id) cursor instead of COUNT(*) + OFFSET, so
+    every page is a range scan on an index no matter how deep the client goes.
+
+    The ordering key is the first order_by() term of the filtered queryset
+    (which is what OrderingFilter sets for ?ordering=unit_price), otherwise
+    the view's `keyset_ordering`, otherwise `ordering` below.
+    """
+
+    page_size = 10
+    cursor_query_param = "cursor"
+    ordering = "-id"
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.finish_page(list(self.get_page_queryset(queryset, request, view)))
+
+    def get_page_queryset(self, queryset, request, view=None):
+        """
+        The unevaluated query for the page (plus one row to tell whether there
+        is more), to be evaluated by the caller and passed to finish_page().
+        """
+        self.base_url = request.build_absolute_uri()
+        key = self.get_ordering_key(queryset, view)
+        self.field = key.lstrip("-")
+        self.descending = key.startswith("-")
+
+        cursor = self.decode_cursor(request, queryset)
+        reverse = cursor is not None and cursor[2]
+
+        # Walking backwards (previous link) flips the direction of the scan,
+        # the page is turned around again before it is returned.
+        descending = self.descending != reverse
+        if queryset._fields and self.field not in queryset._fields:
+            # .values() rows need the key to build the cursors
+            queryset = queryset.values(*queryset._fields, self.field)
+        if self.field == "id":
+            queryset = queryset.order_by("-id" if descending else "id")
+        else:
+            queryset = queryset.order_by(
+                *(["-" + self.field, "-id"] if descending else [self.field, "id"])
+            )
+
+        if cursor is not None:
+            value, pk, _ = cursor
+            lookup, range_lookup = ("lt", "lte") if descending else ("gt", "gte")
+            if self.field == "id":
+                queryset = queryset.filter(**{"id__" + lookup: pk})
+            else:
+                # key >= value narrows the index range, the OR breaks ties on id
+                queryset = queryset.filter(
+                    Q(**{f"{self.field}__{range_lookup}": value})
+                    & (
+                        Q(**{f"{self.field}__{lookup}": value})
+                        | Q(**{"id__" + lookup: pk})
+                    )
+                )
+
+        self.cursor = cursor
+        return queryset[: self.page_size + 1]
+
+    def finish_page(self, rows):
+        cursor = self.cursor
+        reverse = cursor is not None and cursor[2]
+        has_more = len(rows) > self.page_size
+        rows = rows[: self.page_size]
+        if reverse:
+            rows.reverse()
+
+        self.has_next = cursor is not None if reverse else has_more
+        self.has_previous = has_more if reverse else cursor is not None
+        self.page = rows
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response(
+            OrderedDict(
+                [
+                    ("next", self.get_next_link()),
+                    ("previous", self.get_previous_link()),
+                    ("results", data),
+                ]
+            )
+        )
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "next": {"type": "string", "nullable": True},
+                "previous": {"type": "string", "nullable": True},
+                "results": schema,
+            },
+        }
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_ordering_key(self, queryset, view):
+        order_by = queryset.query.order_by
+        if order_by and isinstance(order_by[0], str) and order_by[0] != "?":
+            key = order_by[0]
+        else:
+            key = getattr(view, "keyset_ordering", self.ordering)
+        if key.lstrip("-") == "pk":
+            key = key.replace("pk", "id")
+        return key
+
+    def get_row_value(self, row, name):
+        if isinstance(row, dict):
+            return row[name]
+        for attr in name.split("__"):
+            row = getattr(row, attr)
+        return row
+
+    def get_output_field(self, queryset, name):
+        try:
+            return queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            annotation = queryset.query.annotations.get(name)
+            return annotation.output_field if annotation is not None else None
+
+    def encode_cursor(self, row, reverse):
+        value = self.get_row_value(row, self.field)
+        pk = self.get_row_value(row, "id")
+        payload = {"k": value if isinstance(value, int) else str(value), "i": pk}
+        if reverse:
+            payload["r"] = 1
+        encoded = base64.urlsafe_b64encode(
+            json.dumps(payload, separators=(",", ":")).encode("ascii")
+        ).decode("ascii")
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request, queryset):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode("ascii")))
+            value, pk = payload["k"], int(payload["i"])
+            field = self.get_output_field(queryset, self.field)
+            if field is not None:
+                value = field.to_python(value)
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+        return value, pk, bool(payload.get("r"))
+
+
+class OptionalKeysetPagination(BasePagination):
+    """
+    Keeps a list's response as it was, paginated by `fallback_class` or a
+    plain array when that is None, and switches to KeysetPagination when
+    the client asks for it with ?pagination=keyset. The cursors it hands out
+    keep selecting it.
+    """
+
+    fallback_class = None
+    mode_query_param = "pagination"
+    keyset_mode = "keyset"
+
+    def __init__(self):
+        self.keyset = KeysetPagination()
+        self.fallback = self.fallback_class() if self.fallback_class else None
+        self.selected = None
+
+    def uses_keyset(self, request):
+        params = request.query_params
+        return (
+            params.get(self.mode_query_param) == self.keyset_mode
+            or self.keyset.cursor_query_param in params
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.selected = self.keyset if self.uses_keyset(request) else self.fallback
+        if self.selected is None:
+            return None
+        return self.selected.paginate_queryset(queryset, request, view)
+
+    async def aget_page_queryset(self, queryset, request, view=None):
+        """
+        The unevaluated query for the page from the selected pagination, to
+        be evaluated by the caller and passed to finish_page(). None if the
+        list is not paginated.
+        """
+        self.selected = self.keyset if self.uses_keyset(request) else self.fallback
+        if self.selected is None:
+            return None
+        if self.selected is self.keyset:
+            return self.keyset.get_page_queryset(queryset, request, view)
+        return await self.selected.aget_page_queryset(queryset, request, view)
+
+    def finish_page(self, rows):
+        return self.selected.finish_page(rows)
+
+    def get_paginated_response(self, data):
+        return self.selected.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        if self.fallback is None:
+            return schema
+        return self.fallback.get_paginated_response_schema(schema)
+
+    @property
+    def display_page_controls(self):
+        return getattr(self.selected, "display_page_controls", False)
+
+    def to_html(self):
+        return self.selected.to_html()
+
+
+class PageNumberOrKeysetPagination(OptionalKeysetPagination):
+    fallback_class = DefaultPagination
+
+
+ROW_COUNT_CACHE_TIMEOUT = 60 * 5
+
+
+def estimated_row_count(model, using):
+    """
+    Roughly how many rows the model's table has, without COUNT(*) on MySQL.
+    InnoDB's TABLE_ROWS may be off by tens of percent.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    if connection.vendor == "mysql":
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT TABLE_ROWS FROM information_schema.TABLES"
+                " WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+                [table],
+            )
+            row = cursor.fetchone()
+        if row is not None and row[0] is not None:
+            return row[0]
+
+    # No statistics to read, count once in a while instead
+    key = f"store:row-count:{using}:{table}"
+    count = cache.get(key)
+    if count is None:
+        count = model._base_manager.using(using).count()
+        cache.set(key, count, ROW_COUNT_CACHE_TIMEOUT)
+    return count
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    A Django paginator that does not COUNT(*) large tables. Above
+    `threshold` rows (ADMIN_ESTIMATED_COUNT_THRESHOLD), an unfiltered
+    queryset is counted from table statistics and a filtered one only up to
+    the threshold. `estimated` tells whether `count` is exact, `truncated`
+    that it stopped at the threshold.
+    """
+
+    def __init__(self, *args, exact=False, threshold=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.exact = exact
+        if threshold is None:
+            threshold = getattr(settings, "ADMIN_ESTIMATED_COUNT_THRESHOLD", 100000)
+        self.threshold = threshold
+        self.estimated = self.truncated = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if self.exact or not hasattr(queryset, "query"):
+            return super().count
+
+        estimate = estimated_row_count(queryset.model, queryset.db)
+        if estimate < self.threshold:
+            return super().count
+        if not queryset.query.has_filters():
+            self.estimated = True
+            return estimate
+
+        # A filter may match few rows or most of the table, either way no
+        # more than threshold + 1 of them are counted
+        count = queryset.order_by()[: self.threshold + 1].count()
+        self.estimated = self.truncated = count > self.threshold
+        return count
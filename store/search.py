@@ -0,0 +1,116 @@
+import re
+import unicodedata
+from django.db import connection, transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Q, Subquery, Sum, When
+from rest_framework.filters import SearchFilter
+from .models import ProductSearchToken
+
+TOKEN_PATTERN = re.compile(r"\w+")
+MAX_TOKEN_LENGTH = 64
+TITLE_WEIGHT = 3
+DESCRIPTION_WEIGHT = 1
+
+
+def fold(text):
+    """
+    Lowercases `text` and strips its accents, so "Café" finds "cafe". The
+    term column compares byte for byte, so folding is the only equivalence
+    and it is the same on every backend.
+    """
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def tokenize(text):
+    if not text:
+        return []
+    return [token[:MAX_TOKEN_LENGTH] for token in TOKEN_PATTERN.findall(fold(text))]
+
+
+def build_tokens(product):
+    weights = {}
+    for token in tokenize(product.title):
+        weights[token] = weights.get(token, 0) + TITLE_WEIGHT
+    for token in tokenize(product.description):
+        weights[token] = weights.get(token, 0) + DESCRIPTION_WEIGHT
+
+    return [
+        ProductSearchToken(product_id=product.id, term=term, weight=weight)
+        for term, weight in weights.items()
+    ]
+
+
+def index_products(products):
+    products = list(products)
+    with transaction.atomic():
+        ProductSearchToken.objects.filter(
+            product_id__in=[product.id for product in products]
+        ).delete()
+        ProductSearchToken.objects.bulk_create(
+            [token for product in products for token in build_tokens(product)]
+        )
+
+
+def prefix_match(term):
+    if connection.vendor != "sqlite":
+        # LIKE BINARY 'term%' on MySQL, served from the (term, product)
+        # index because the column's collation is binary too
+        return Q(term__startswith=term)
+    # SQLite's LIKE is case-insensitive and can't use the index. Its binary
+    # collation orders by code point, so term <= t < term with its last
+    # character incremented is every token starting with `term`.
+    upper = term[:-1] + chr(ord(term[-1]) + 1)
+    return Q(term__gte=term, term__lt=upper)
+
+
+def search_products(queryset, text, rank=True):
+    """
+    Restricts `queryset` to products matching every word of `text` as a
+    prefix. With `rank`, annotates `search_rank` (exact matches count double)
+    and orders by it.
+    """
+    terms = list(dict.fromkeys(tokenize(text)))
+    if not terms:
+        return queryset
+
+    matched = Q()
+    for term in terms:
+        queryset = queryset.filter(
+            id__in=ProductSearchToken.objects.filter(prefix_match(term)).values(
+                "product_id"
+            )
+        )
+        matched |= prefix_match(term)
+
+    if not rank:
+        return queryset
+
+    ranks = (
+        ProductSearchToken.objects.filter(matched, product=OuterRef("pk"))
+        .order_by()
+        .values("product")
+        .annotate(
+            rank=Sum(
+                Case(
+                    When(term__in=terms, then=F("weight") * 2),
+                    default=F("weight"),
+                    output_field=IntegerField(),
+                )
+            )
+        )
+        .values("rank")
+    )
+    return queryset.annotate(search_rank=Subquery(ranks)).order_by("-search_rank", "id")
+
+
+class ProductSearchFilter(SearchFilter):
+    """
+    ?search= looked up in the ProductSearchToken index instead of a
+    LIKE '%term%' scan over `search_fields`.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        text = request.query_params.get(self.search_param, "")
+        if not text.strip():
+            return queryset
+        return search_products(queryset, text)
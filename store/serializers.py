@@ -1,18 +1,16 @@
-from decimal import Decimal
 from rest_framework import serializers
 from . import models
+from . import carts
 from django.db import transaction
-from .signals import order_created
+from . import outbox
+from storefront.db_routers import pin_primary
 
 class CollectionSerializer(serializers.ModelSerializer):
     class Meta:
         model = models.Collection
         fields = ["id", "title", "products_count"]
 
-    products_count = serializers.IntegerField()
-
-    def get_product_count(self, collection):
-        return collection.products.count()
+    products_count = serializers.IntegerField(read_only=True)
 
 
 class ProductSerializer(serializers.ModelSerializer):
@@ -27,7 +25,10 @@ class ProductSerializer(serializers.ModelSerializer):
     )
 
     def get_price_with_tax(self, product):
-        return product.unit_price * Decimal(1.18)
+        # Annotated by Product.objects.with_price_with_tax() on the read paths
+        if hasattr(product, "price_with_tax"):
+            return product.price_with_tax
+        return product.unit_price * models.TAX_RATE
 
     def create(self, validated_data):
         product = models.Product(**validated_data)
@@ -60,6 +61,9 @@ class CartItemForCartSerializer(serializers.ModelSerializer):
     total_price = serializers.SerializerMethodField()
 
     def get_total_price(self, cart_item: models.CartItem):
+        # Annotated by CartItem.objects.with_total_price()
+        if hasattr(cart_item, "total_price"):
+            return cart_item.total_price
         return cart_item.product.unit_price * cart_item.quantity
 
 
@@ -81,6 +85,10 @@ class CartSerializer(serializers.ModelSerializer):
     total_cart_value = serializers.SerializerMethodField()
 
     def get_total_cart_value(self, cart: models.Cart):
+        # Annotated by Cart.objects.with_totals()
+        if hasattr(cart, "total_cart_value"):
+            return cart.total_cart_value
+
         total_value = 0
 
         for cart_item in cart.cartitems.all():
@@ -100,32 +108,29 @@ class CartItemCreateSerializer(serializers.ModelSerializer):
         )
 
     def save(self, **kwargs):
-        cart_id = self.context["cart_id"]
-        product_id = self.validated_data["product_id"]
-        quantity = self.validated_data["quantity"]
-
-        try:
-            cart_item = models.CartItem.objects.get(
-                cart_id=cart_id, product_id=product_id
-            )
-            cart_item.quantity += quantity
-            cart_item.save()
-            self.instance = cart_item
-        except models.CartItem.DoesNotExist:
-            self.instance = models.CartItem.objects.create(
-                cart_id=cart_id, **self.validated_data
-            )
-
+        self.instance = models.CartItem.objects.add_quantity(
+            self.context["cart_id"],
+            self.validated_data["product"].id,
+            self.validated_data["quantity"],
+        )
         return self.instance
 
 
 class CartItemReadSerializer(serializers.ModelSerializer):
     class Meta:
         model = models.CartItem
-        fields = ["id", "product", "quantity"]
+        fields = ["id", "product", "quantity", "total_price"]
 
         product = serializers.StringRelatedField()
 
+    total_price = serializers.SerializerMethodField()
+
+    def get_total_price(self, cart_item: models.CartItem):
+        # Annotated by CartItem.objects.with_total_price()
+        if hasattr(cart_item, "total_price"):
+            return cart_item.total_price
+        return cart_item.quantity * cart_item.product.unit_price
+
 
 class CartItemUpdateSerializer(serializers.ModelSerializer):
     class Meta:
@@ -142,10 +147,10 @@ class CustomerSerializer(serializers.ModelSerializer):
 
 
 class OrderItemSerializer(serializers.ModelSerializer):
-    product = ProductSerializer(many=True)
+    product = ProductSerializer()
 
     class Meta:
-        model = models.Order
+        model = models.OrderItem
         fields = ["id", "product", "quantity", "unit_price"]
 
 
@@ -154,40 +159,106 @@ class OrderCreateSerializer(serializers.Serializer):
 
     # to validate cart id (exists or not)
     def validate_cart_id(self, cart_id):
-        if not models.Cart.objects.filter(pk=cart_id).exists():
-            raise serializers.ValidationError("No cart with the given id found")
-
-        if models.CartItem.objects.filter(cart_id=cart_id).count() == 0:
-            raise serializers.ValidationError("The cart is empty")
-
+        # Read from wherever the cart is kept. It can still change until
+        # place_order() holds its lock, which checks again.
+        if carts.cache_enabled():
+            state = carts.load_state(cart_id)
+            error = self.get_cart_error(state is not None, state and state["items"])
+        else:
+            error = self.get_cart_error(
+                models.Cart.objects.filter(pk=cart_id).exists(),
+                models.CartItem.objects.filter(cart_id=cart_id).count(),
+            )
+        if error is not None:
+            raise serializers.ValidationError(error)
         return cart_id
 
+    def get_cart_error(self, exists, item_count):
+        if not exists:
+            return "No cart with the given id found"
+        if not item_count:
+            return "The cart is empty"
+        return None
+
     def save(self, **kwargs):
+        # Checkout never reads from a replica, whatever view calls it
+        with pin_primary():
+            return self.place_order()
+
+    def place_order(self):
         cart_id = self.validated_data["cart_id"]
 
-        with transaction.atomic():
-            customer = models.Customer.objects.get(
-                user_id=self.context["user_id"]
-            )
-            order = models.Order.objects.create(customer=customer)
-            cart_items = models.CartItem.objects.select_related("product").filter(
-                cart_id=cart_id
+        # Held until commit, so flush_carts can't write the cart back after
+        # the order deleted it
+        with carts.checkout_lock(cart_id), transaction.atomic():
+            # A cart kept in the cache is written out under the lock, so
+            # the order has every item added before checkout took it
+            carts.persist_cart(cart_id)
+            cart_items = list(
+                models.CartItem.objects.select_related("product").filter(
+                    cart_id=cart_id
+                )
             )
-
-            order_items = [
-                models.OrderItem(
-                    order=order,
-                    product=item.product,
-                    unit_price=item.product.unit_price,
-                    quantity=item.quantity,
+            if not cart_items:
+                error = self.get_cart_error(
+                    models.Cart.objects.filter(pk=cart_id).exists(), 0
+                )
+                raise serializers.ValidationError({"cart_id": [error]})
+
+            # Reserve stock for every line in one conditional UPDATE before
+            # writing anything else. Its exclusive row locks are taken in id
+            # order. Inserting the order items first would take shared locks
+            # on the same product rows for their foreign keys, and two
+            # checkouts upgrading those deadlock on MySQL.
+            quantities = {item.product_id: item.quantity for item in cart_items}
+            if models.Product.objects.reserve_inventory(quantities) < len(quantities):
+                # Undo whatever part of the stock was reserved
+                transaction.set_rollback(True)
+                order = None
+            else:
+                order = models.Order.objects.create(
+                    customer_id=self.context["customer_id"]
                 )
-                for item in cart_items
-            ]
-            models.OrderItem.objects.bulk_create(order_items)
-            models.Cart.objects.filter(id=cart_id).delete()
+                models.OrderItem.objects.bulk_create(
+                    [
+                        models.OrderItem(
+                            order=order,
+                            product=item.product,
+                            unit_price=item.product.unit_price,
+                            quantity=item.quantity,
+                        )
+                        for item in cart_items
+                    ]
+                )
+
+                models.Cart.objects.filter(id=cart_id).delete()
+                # The database row is the cart from persist_cart() on, so the
+                # cached copy can go before commit
+                carts.discard_cart(cart_id)
 
-            order_created.send_robust(self.__class__, order=order)
-            return order
+                # Delivered by `manage.py run_outbox` once this commits
+                outbox.enqueue(outbox.ORDER_CREATED, order_id=order.id)
+
+        if order is None:
+            raise serializers.ValidationError(
+                {"cart_id": self.get_inventory_errors(quantities)}
+            )
+        return order
+
+    def get_inventory_errors(self, quantities):
+        available = dict(
+            models.Product.objects.filter(id__in=list(quantities)).values_list(
+                "id", "inventory"
+            )
+        )
+        errors = [
+            f"Only {available.get(product_id, 0)} left of product {product_id},"
+            f" {quantity} requested."
+            for product_id, quantity in quantities.items()
+            if available.get(product_id, 0) < quantity
+        ]
+        # Stock may have been replenished since the update
+        return errors or ["Not enough inventory, please try again."]
 
 
 class OrderSerializer(serializers.ModelSerializer):
@@ -1,6 +1,11 @@
-from ..models import Customer
+from ..models import Customer, Product, Collection, Promotion
+from ..caching import bump_version
+from ..search import index_products
+from ..customers import forget_customer_id
 from django.dispatch import receiver
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
 from django.conf import settings
 
 
@@ -8,3 +13,80 @@ from django.conf import settings
 def create_customer_for_new_user(sender, **kwargs):
     if kwargs["created"]:
         Customer.objects.create(user=kwargs["instance"])
+
+
+@receiver(post_delete, sender=Customer)
+def forget_deleted_customer_id(sender, instance, **kwargs):
+    forget_customer_id(instance.user_id)
+
+
+# Bump the version only once the change is committed, otherwise a concurrent
+# read could cache the old rows under the new version.
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Collection)
+@receiver([post_save, post_delete], sender=Promotion)
+def bump_catalog_version(sender, **kwargs):
+    transaction.on_commit(lambda: bump_version(sender))
+
+
+@receiver(m2m_changed, sender=Product.promotions.through)
+def bump_product_promotions_version(sender, **kwargs):
+    transaction.on_commit(lambda: bump_version(Product))
+
+
+def adjust_products_count(collection_id, delta):
+    Collection.objects.filter(pk=collection_id).update(
+        products_count=F("products_count") + delta
+    )
+
+
+def saves_any(update_fields, *names):
+    """Whether a save with these update_fields writes any of the fields."""
+    return update_fields is None or not update_fields.isdisjoint(names)
+
+
+@receiver(pre_save, sender=Product)
+def remember_previous_collection(sender, instance, update_fields=None, **kwargs):
+    if instance.pk is None or not saves_any(
+        update_fields, "collection", "collection_id"
+    ):
+        return
+    if getattr(instance, "_loaded_collection_id", None) is None:
+        # Built by hand or loaded with the collection deferred
+        instance._loaded_collection_id = (
+            Product.objects.filter(pk=instance.pk)
+            .values_list("collection_id", flat=True)
+            .first()
+        )
+
+
+@receiver(post_save, sender=Product)
+def update_products_count_on_save(
+    sender, instance, created, update_fields=None, **kwargs
+):
+    # A save that leaves the collection out doesn't move the row, whatever
+    # collection_id the instance holds
+    if not saves_any(update_fields, "collection", "collection_id"):
+        return
+    previous = getattr(instance, "_loaded_collection_id", None)
+    if created:
+        adjust_products_count(instance.collection_id, 1)
+    elif previous != instance.collection_id:
+        adjust_products_count(previous, -1)
+        adjust_products_count(instance.collection_id, 1)
+    instance._loaded_collection_id = instance.collection_id
+
+
+@receiver(post_delete, sender=Product)
+def update_products_count_on_delete(sender, instance, **kwargs):
+    adjust_products_count(instance.collection_id, -1)
+
+
+@receiver(post_save, sender=Product)
+def update_search_index(sender, instance, created, update_fields=None, **kwargs):
+    if not saves_any(update_fields, "title", "description"):
+        return
+    search_text = (instance.title, instance.description)
+    if created or getattr(instance, "_loaded_search_text", None) != search_text:
+        index_products([instance])
+        instance._loaded_search_text = search_text
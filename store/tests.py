@@ -1,3 +1,1560 @@
-from django.test import TestCase
+import contextlib
+import csv
+import json
+import re
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+from uuid import uuid4
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import Count, F
+from django.test import (
+    RequestFactory,
+    SimpleTestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path
+from django.utils import timezone
+from prometheus_client import REGISTRY
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient, APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+from tags.models import Tag, TaggedItem
+from core.authentication import user_cache
+from core.tests import share_cache
+from storefront.caches import require_shared_cache
+from storefront.db_routers import (
+    ReplicaRouter,
+    pin_primary,
+    reads_from_replica,
+    replica_reads,
+)
+from . import carts, outbox
+from . import urls as store_urls
+from .admin import ProductAdmin
+from .async_views import async_read_urls
+from .management.commands.run_benchmark import Command
+from .models import (
+    Cart,
+    CartItem,
+    Collection,
+    Customer,
+    Order,
+    OrderItem,
+    OutboxEvent,
+    Product,
+    ProductSearchToken,
+    Promotion,
+    Review,
+)
+from .pagination import DefaultPagination
+from .serializers import CartItemReadSerializer, OrderCreateSerializer
+from .search import DESCRIPTION_WEIGHT, TITLE_WEIGHT, search_products
+from .views import CollectionViewSet, OrderViewSet, ProductViewSet
 
-# Create your tests here.
+
+def create_product(
+    collection, title="P", unit_price=Decimal("10.00"), inventory=10, **fields
+):
+    return Product.objects.create(
+        title=title,
+        unit_price=unit_price,
+        inventory=inventory,
+        collection=collection,
+        **fields,
+    )
+
+
+def create_orders(customer, products, count):
+    for _ in range(count):
+        order = Order.objects.create(customer=customer)
+        OrderItem.objects.bulk_create(
+            [
+                OrderItem(
+                    order=order,
+                    product=product,
+                    quantity=2,
+                    unit_price=product.unit_price,
+                )
+                for product in products
+            ]
+        )
+
+
+class OrderListTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = get_user_model().objects.create_user(
+            username="admin", email="admin@example.com", is_staff=True
+        )
+        cls.customer = Customer.objects.get(user=cls.admin)
+        collections = [Collection.objects.create(title=f"C{i}") for i in range(2)]
+        cls.products = [
+            create_product(collections[i % 2], f"P{i}", Decimal("10.00") + i)
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        self.client.force_authenticate(self.admin)
+
+    def get_orders(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/store/order/")
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_items_are_serialized_with_their_product(self):
+        create_orders(self.customer, self.products[:1], 1)
+
+        response, _ = self.get_orders()
+
+        item = response.data[0]["items"][0]
+        self.assertEqual(item["quantity"], 2)
+        self.assertEqual(item["product"]["id"], self.products[0].id)
+        self.assertTrue(
+            item["product"]["collection"].endswith(
+                f"/store/collection/{self.products[0].collection_id}/"
+            )
+        )
+
+    def test_query_count_does_not_grow_with_orders_or_items(self):
+        create_orders(self.customer, self.products[:1], 1)
+        _, few = self.get_orders()
+
+        create_orders(self.customer, self.products, 8)
+        _, many = self.get_orders()
+
+        # orders, their items, the items' products
+        self.assertEqual(few, 3)
+        self.assertEqual(many, few)
+
+    def test_export_streams_one_line_per_order(self):
+        create_orders(self.customer, self.products, 3)
+
+        response = self.client.get("/store/order/export/?payment_status=P")
+
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = b"".join(response.streaming_content).splitlines()
+        orders = [json.loads(line) for line in lines]
+        self.assertEqual(len(orders), 3)
+        self.assertEqual([len(order["items"]) for order in orders], [3, 3, 3])
+
+    def test_export_pages_by_id(self):
+        create_orders(self.customer, self.products[:1], 5)
+
+        with mock.patch.object(OrderViewSet, "export_chunk_size", 2):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get("/store/order/export/")
+                lines = b"".join(response.streaming_content).splitlines()
+
+        self.assertEqual(
+            [json.loads(line)["id"] for line in lines],
+            list(Order.objects.order_by("id").values_list("id", flat=True)),
+        )
+        order_pages = [
+            query["sql"]
+            for query in queries
+            if query["sql"].startswith('SELECT "store_order"."id"')
+        ]
+        # 2 + 2 + 1 orders
+        self.assertEqual(len(order_pages), 3)
+        self.assertIn('"store_order"."id" >', order_pages[1])
+
+        response = self.client.get("/store/order/export/?payment_status=C")
+        self.assertEqual(b"".join(response.streaming_content), b"")
+
+
+class CheckoutTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title="C")
+        cls.products = [
+            create_product(collection, f"P{i}", inventory=inventory)
+            for i, inventory in enumerate([5, 1, 0])
+        ]
+        cls.user = get_user_model().objects.create_user(
+            username="user", email="user@example.com"
+        )
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def checkout(self, quantities):
+        cart = Cart.objects.create()
+        CartItem.objects.bulk_create(
+            CartItem(cart=cart, product=product, quantity=quantity)
+            for product, quantity in zip(self.products, quantities)
+        )
+        return cart, self.client.post("/store/order/", {"cart_id": str(cart.id)})
+
+    def inventory(self):
+        return list(
+            Product.objects.filter(id__in=[product.id for product in self.products])
+            .order_by("id")
+            .values_list("inventory", flat=True)
+        )
+
+    def test_order_reserves_stock_and_deletes_the_cart(self):
+        cart, response = self.checkout([2, 1])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["items"]), 2)
+        self.assertEqual(self.inventory(), [3, 0, 0])
+        self.assertFalse(Cart.objects.filter(pk=cart.pk).exists())
+
+    def test_insufficient_stock_reserves_nothing(self):
+        cart, response = self.checkout([2, 3, 1])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.data["cart_id"],
+            [
+                f"Only 1 left of product {self.products[1].id}, 3 requested.",
+                f"Only 0 left of product {self.products[2].id}, 1 requested.",
+            ],
+        )
+        self.assertEqual(self.inventory(), [5, 1, 0])
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+        self.assertTrue(CartItem.objects.filter(cart=cart).exists())
+
+
+class ProductsCountTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.snacks = Collection.objects.create(title="Snacks")
+        cls.drinks = Collection.objects.create(title="Drinks")
+
+    def assertCounts(self, snacks, drinks):
+        self.assertEqual(
+            [
+                Collection.objects.get(pk=collection.pk).products_count
+                for collection in [self.snacks, self.drinks]
+            ],
+            [snacks, drinks],
+        )
+
+    def test_create(self):
+        create_product(self.snacks)
+        create_product(self.snacks)
+
+        self.assertCounts(2, 0)
+
+    def test_move(self):
+        product = create_product(self.snacks)
+
+        product.collection = self.drinks
+        product.save()
+        self.assertCounts(0, 1)
+
+        # A second save from the same instance doesn't move it again
+        product.save()
+        self.assertCounts(0, 1)
+
+        product = Product.objects.only("id", "title").get(pk=product.pk)
+        product.collection = self.snacks
+        product.save()
+        self.assertCounts(1, 0)
+
+    def test_save_without_the_collection_in_update_fields(self):
+        product = create_product(self.snacks)
+
+        product.collection = self.drinks
+        product.unit_price = Decimal("12.00")
+        product.save(update_fields=["unit_price"])
+        self.assertCounts(1, 0)
+
+        product.save(update_fields=["collection"])
+        self.assertCounts(0, 1)
+
+    def test_delete(self):
+        product = create_product(self.snacks)
+        create_product(self.snacks)
+
+        product.delete()
+
+        self.assertCounts(1, 0)
+
+    def test_recount_products(self):
+        create_product(self.snacks)
+        Collection.objects.update(products_count=5)
+
+        call_command("recount_products", stdout=StringIO())
+
+        self.assertCounts(1, 0)
+
+
+class SearchTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title="C")
+        for title, description in [
+            ("Café Crème", "Fresh roast"),
+            ("Cafe Latte", "Milk"),
+            ("Jazz Tea", "Fizzy"),
+            ("Tea 9", "Batch_9 blend"),
+            ("Daily Honey", "Raw"),
+        ]:
+            create_product(collection, title, description=description)
+
+    def search(self, text):
+        # Ranges on SQLite, LIKE 'term%' on MySQL and other backends
+        results = {}
+        for vendor in ["sqlite", "mysql"]:
+            with mock.patch.object(connection, "vendor", vendor):
+                results[vendor] = [
+                    product.title
+                    for product in search_products(Product.objects.all(), text)
+                ]
+        self.assertEqual(results["sqlite"], results["mysql"])
+        return results["sqlite"]
+
+    def test_accents_are_folded(self):
+        self.assertEqual(set(self.search("cafe")), {"Café Crème", "Cafe Latte"})
+        self.assertEqual(set(self.search("CAFÉ")), {"Café Crème", "Cafe Latte"})
+        self.assertEqual(self.search("creme"), ["Café Crème"])
+
+    def test_cafe_and_café_are_one_term(self):
+        product = Product.objects.get(title="Café Crème")
+        product.description = "Cafe au lait"
+        product.save()
+
+        self.assertEqual(
+            ProductSearchToken.objects.get(product=product, term="cafe").weight,
+            TITLE_WEIGHT + DESCRIPTION_WEIGHT,
+        )
+
+    def test_prefixes_ending_in_z_9_and_underscore(self):
+        self.assertEqual(self.search("jaz"), ["Jazz Tea"])
+        self.assertEqual(self.search("fizz"), ["Jazz Tea"])
+        self.assertEqual(self.search("batch_"), ["Tea 9"])
+        self.assertEqual(self.search("9"), ["Tea 9"])
+
+    def test_every_word_must_match_and_exact_matches_rank_first(self):
+        self.assertEqual(self.search("tea"), ["Jazz Tea", "Tea 9"])
+        self.assertEqual(self.search("tea raw"), [])
+        self.assertEqual(self.search("da"), ["Daily Honey"])
+
+    def test_terms_compare_byte_for_byte(self):
+        field = ProductSearchToken._meta.get_field("term")
+        for vendor, collation in [
+            ("mysql", "utf8mb4_bin"),
+            ("postgresql", "C"),
+            ("sqlite", None),
+        ]:
+            with self.subTest(vendor=vendor), mock.patch.object(
+                connection, "vendor", vendor
+            ):
+                self.assertEqual(
+                    field.db_parameters(connection)["collation"], collation
+                )
+
+    def test_search_param(self):
+        response = self.client.get("/store/product/?search=caf")
+
+        self.assertEqual(response.data["count"], 2)
+
+
+class AddToCartTests(TransactionTestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title="C")
+        self.product = create_product(collection)
+        self.cart = Cart.objects.create()
+        self.url = f"/store/cart/{self.cart.id}/cartitems/"
+
+    def add(self, quantity):
+        return APIClient().post(
+            self.url, {"product": self.product.id, "quantity": quantity}, format="json"
+        )
+
+    def test_adding_twice_increments_the_same_item(self):
+        self.add(2)
+        response = self.add(3)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["quantity"], 5)
+        self.assertEqual(CartItem.objects.get(cart=self.cart).quantity, 5)
+
+    def test_items_without_the_annotation_are_priced(self):
+        self.add(3)
+        item = CartItem.objects.get(cart=self.cart)
+
+        self.assertEqual(
+            CartItemReadSerializer(item).data["total_price"], Decimal("30.00")
+        )
+
+    def test_concurrent_adds_are_all_counted(self):
+        threads, statuses = 8, []
+        barrier = threading.Barrier(threads)
+
+        def add():
+            barrier.wait()
+            try:
+                statuses.append(self.add(1).status_code)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=add) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(statuses, [201] * threads)
+        item = CartItem.objects.get(cart=self.cart, product=self.product)
+        self.assertEqual(item.quantity, threads)
+
+
+@override_settings(CART_STORAGE="cache")
+class CachedCartTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title="C")
+        cls.products = [create_product(collection, f"P{i}") for i in range(2)]
+        user = get_user_model().objects.create_user(
+            username="user", email="user@example.com"
+        )
+        cls.customer = Customer.objects.get(user=user)
+
+    def setUp(self):
+        cache.clear()
+
+    def create_cart(self, quantity=1):
+        cart_id = carts.create_cart().id
+        carts.add_item(cart_id, self.products[0].id, quantity)
+        return cart_id
+
+    def stored_items(self, cart_id):
+        return dict(
+            CartItem.objects.filter(cart_id=cart_id).values_list(
+                "product_id", "quantity"
+            )
+        )
+
+    def test_changes_are_written_by_flush(self):
+        cart_id = self.create_cart()
+        self.assertFalse(Cart.objects.filter(pk=cart_id).exists())
+
+        self.assertEqual(carts.flush_dirty_carts(), 1)
+        self.assertEqual(self.stored_items(cart_id), {self.products[0].id: 1})
+        # Nothing changed since
+        self.assertEqual(carts.flush_dirty_carts(), 0)
+
+        carts.add_item(cart_id, self.products[0].id, 2)
+        carts.add_item(cart_id, self.products[1].id, 1)
+        self.assertEqual(carts.flush_dirty_carts(), 1)
+        self.assertEqual(
+            self.stored_items(cart_id),
+            {self.products[0].id: 3, self.products[1].id: 1},
+        )
+
+    def test_each_cart_is_logged_once_between_flushes(self):
+        cart_id = self.create_cart()
+        for _ in range(5):
+            carts.add_item(cart_id, self.products[0].id, 1)
+
+        self.assertEqual(cache.get(carts.DIRTY_LOG_KEY), 1)
+        carts.flush_dirty_carts()
+        self.assertIsNone(cache.get(carts.log_entry_key(1)))
+
+    def test_missing_log_entry_is_waited_for_once(self):
+        first = self.create_cart()
+        # Another writer between incr() and set()
+        cache.incr(carts.DIRTY_LOG_KEY)
+        second = self.create_cart()
+
+        carts.flush_dirty_carts()
+        self.assertEqual(cache.get(carts.FLUSHED_KEY), 1)
+
+        carts.add_item(first, self.products[0].id, 1)
+        carts.flush_dirty_carts()
+        self.assertEqual(cache.get(carts.FLUSHED_KEY), 4)
+        self.assertEqual(self.stored_items(first), {self.products[0].id: 2})
+        self.assertEqual(self.stored_items(second), {self.products[0].id: 1})
+
+    def test_concurrent_flush_is_skipped(self):
+        self.create_cart()
+        cache.add(carts.FLUSH_LOCK_KEY, "other", 60)
+
+        self.assertIsNone(carts.flush_dirty_carts())
+
+    def test_busy_cart_is_left_for_the_next_flush(self):
+        cart_id = self.create_cart()
+        cache.add(carts.lock_key(cart_id), "other", 60)
+
+        self.assertEqual(carts.flush_dirty_carts(), 0)
+        cache.delete(carts.lock_key(cart_id))
+        self.assertEqual(carts.flush_dirty_carts(), 1)
+
+    def test_lock_timeout_fails_without_touching_the_holders_lock(self):
+        cart_id = self.create_cart()
+        cache.add(carts.lock_key(cart_id), "other", 60)
+
+        with mock.patch.object(carts, "LOCK_TIMEOUT", 0):
+            with self.assertRaises(carts.CartBusy):
+                carts.add_item(cart_id, self.products[0].id, 1)
+
+        self.assertEqual(cache.get(carts.lock_key(cart_id)), "other")
+        self.assertEqual(carts.load_state(cart_id)["items"][self.products[0].id], 1)
+
+    def test_expired_lock_is_not_released_by_its_old_holder(self):
+        with carts.cart_lock("cart"):
+            # Expired, and taken by another request
+            cache.set(carts.lock_key("cart"), "other", 60)
+
+        self.assertEqual(cache.get(carts.lock_key("cart")), "other")
+
+    def test_flush_after_checkout_does_not_bring_the_cart_back(self):
+        cart_id = self.create_cart()
+        serializer = OrderCreateSerializer(
+            data={"cart_id": str(cart_id)}, context={"customer_id": self.customer.id}
+        )
+        serializer.is_valid(raise_exception=True)
+
+        # The cart is still in the dirty log. A flush running while the order is placed, before commit
+        flushes = []
+        with mock.patch(
+            "store.outbox.enqueue",
+            side_effect=lambda *args, **kwargs: flushes.append(
+                carts.flush_dirty_carts()
+            ),
+        ):
+            order = serializer.save()
+        flushes.append(carts.flush_dirty_carts())
+
+        self.assertEqual(flushes, [0, 0])
+        self.assertFalse(Cart.objects.filter(pk=cart_id).exists())
+        self.assertEqual(order.items.get().quantity, 1)
+
+    def test_items_added_after_validation_are_ordered(self):
+        cart_id = self.create_cart()
+        serializer = OrderCreateSerializer(
+            data={"cart_id": str(cart_id)}, context={"customer_id": self.customer.id}
+        )
+        serializer.is_valid(raise_exception=True)
+
+        carts.add_item(cart_id, self.products[1].id, 2)
+        order = serializer.save()
+
+        self.assertEqual(
+            dict(order.items.values_list("product_id", "quantity")),
+            {self.products[0].id: 1, self.products[1].id: 2},
+        )
+
+    def test_cart_emptied_after_validation_is_rejected(self):
+        cart_id = self.create_cart()
+        serializer = OrderCreateSerializer(
+            data={"cart_id": str(cart_id)}, context={"customer_id": self.customer.id}
+        )
+        serializer.is_valid(raise_exception=True)
+
+        carts.remove_item(cart_id, self.products[0].id)
+        with self.assertRaises(ValidationError) as raised:
+            serializer.save()
+
+        self.assertEqual(raised.exception.detail, {"cart_id": ["The cart is empty"]})
+        self.assertFalse(Order.objects.exists())
+
+    def test_unknown_cart_is_rejected(self):
+        serializer = OrderCreateSerializer(
+            data={"cart_id": str(uuid4())}, context={"customer_id": self.customer.id}
+        )
+
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(
+            serializer.errors["cart_id"], ["No cart with the given id found"]
+        )
+
+    def test_flush_after_delete_does_not_bring_the_cart_back(self):
+        cart_id = self.create_cart()
+        carts.flush_dirty_carts()
+        carts.add_item(cart_id, self.products[0].id, 1)
+
+        carts.delete_cart(cart_id)
+
+        self.assertEqual(carts.flush_dirty_carts(), 0)
+        self.assertFalse(Cart.objects.filter(pk=cart_id).exists())
+
+    def test_flush_carts_command(self):
+        self.create_cart()
+        out = StringIO()
+
+        call_command("flush_carts", stdout=out)
+
+        self.assertIn("Flushed 1 cart(s).", out.getvalue())
+
+
+class OutboxTests(APITestCase):
+    def setUp(self):
+        # It would close the test transaction's connection
+        patcher = mock.patch("store.outbox.close_old_connections")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.handler = mock.Mock(return_value=[])
+        patcher = mock.patch.dict(outbox.HANDLERS, {"test": self.handler})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def enqueue(self, count=1, **fields):
+        events = [outbox.enqueue("test", n=n) for n in range(count)]
+        OutboxEvent.objects.filter(id__in=[event.id for event in events]).update(
+            **fields
+        )
+        return events
+
+    def test_claims_in_batches_once(self):
+        self.enqueue(3)
+
+        first = outbox.claim_events("a", batch_size=2)
+        second = outbox.claim_events("b", batch_size=2)
+
+        self.assertEqual([event.payload["n"] for event in first], [0, 1])
+        self.assertEqual([event.payload["n"] for event in second], [2])
+        self.assertEqual(outbox.claim_events("c", batch_size=2), [])
+
+    def test_expired_lease_is_claimed_again(self):
+        self.enqueue()
+        outbox.claim_events("a", batch_size=10)
+        OutboxEvent.objects.update(claimed_until=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(len(outbox.claim_events("b", batch_size=10)), 1)
+        self.assertEqual(OutboxEvent.objects.get().claimed_by, "b")
+
+    def test_skips_processed_delayed_and_exhausted_events(self):
+        self.enqueue(processed_at=timezone.now())
+        self.enqueue(available_at=timezone.now() + timedelta(minutes=1))
+        self.enqueue(attempts=outbox.MAX_ATTEMPTS)
+
+        self.assertEqual(outbox.claim_events("a", batch_size=10), [])
+
+    def test_delivered_event_is_marked_processed(self):
+        self.enqueue()
+        [event] = outbox.claim_events("a", batch_size=10)
+
+        self.assertTrue(outbox.process_event(event))
+
+        self.handler.assert_called_once_with({"n": 0})
+        event.refresh_from_db()
+        self.assertIsNotNone(event.processed_at)
+        self.assertIsNone(event.claimed_by)
+
+    def test_failure_is_retried_with_backoff(self):
+        # send_robust() returns receiver errors instead of raising them
+        self.handler.return_value = [(None, ValueError("down"))]
+        self.enqueue(attempts=2)
+        [event] = outbox.claim_events("a", batch_size=10)
+
+        before = timezone.now()
+        self.assertFalse(outbox.process_event(event))
+
+        event.refresh_from_db()
+        self.assertEqual(event.attempts, 3)
+        self.assertEqual(event.last_error, "ValueError('down')")
+        self.assertIsNone(event.processed_at)
+        self.assertIsNone(event.claimed_by)
+        self.assertGreaterEqual(event.available_at, before + timedelta(seconds=8))
+        self.assertLess(event.available_at, before + timedelta(seconds=9))
+
+    def test_backoff_is_capped(self):
+        self.handler.side_effect = ValueError("down")
+        self.enqueue(attempts=outbox.MAX_ATTEMPTS - 1)
+        [event] = outbox.claim_events("a", batch_size=10)
+
+        before = timezone.now()
+        outbox.process_event(event)
+
+        event.refresh_from_db()
+        self.assertLess(
+            event.available_at,
+            before + timedelta(seconds=outbox.MAX_RETRY_DELAY + 1),
+        )
+        self.assertEqual(outbox.claim_events("a", batch_size=10), [])
+
+    def test_pool_closes_each_threads_connections_on_shutdown(self):
+        closed = []
+        with mock.patch("store.outbox.connections") as connections:
+            connections.close_all.side_effect = lambda: closed.append(
+                threading.get_ident()
+            )
+            with outbox.OutboxPool(3) as pool:
+                pool.submit(lambda: None).result()
+
+        self.assertEqual(len(set(closed)), 3)
+
+
+class ConditionalGetTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title="C")
+        cls.product = create_product(collection)
+
+    def test_unchanged_product_is_not_modified_without_queries(self):
+        url = f"/store/product/{self.product.id}/"
+        etag = self.client.get(url)["ETag"]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(queries), 0)
+
+    def test_changed_product_is_sent_again(self):
+        url = f"/store/product/{self.product.id}/"
+        etag = self.client.get(url)["ETag"]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.unit_price = Decimal("12.00")
+            self.product.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["unit_price"], "12.00")
+
+
+class SharedCacheTests(SimpleTestCase):
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    )
+    def test_several_processes_need_a_shared_cache(self):
+        require_shared_cache(1)
+        with self.assertRaisesMessage(ImproperlyConfigured, "Set REDIS_URL"):
+            require_shared_cache(4)
+
+    @override_settings(
+        CACHES={
+            "default": {
+                "BACKEND": "django.core.cache.backends.redis.RedisCache",
+                "LOCATION": "redis://localhost:6379/0",
+            }
+        }
+    )
+    def test_redis_is_shared(self):
+        require_shared_cache(4)
+
+
+class FastReadParityTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        collections = [Collection.objects.create(title=f"C{i}") for i in range(3)]
+        cls.products = [
+            create_product(collections[i % 3], f"Product {i}", Decimal("9.99") + i)
+            for i in range(40)
+        ]
+        cls.collection = collections[0]
+
+    def get_both(self, url):
+        cache.clear()
+        fast = self.client.get(url)
+        cache.clear()
+        with mock.patch.object(ProductViewSet, "read_plan", None), mock.patch.object(
+            CollectionViewSet, "read_plan", None
+        ):
+            slow = self.client.get(url)
+        self.assertEqual(fast.status_code, slow.status_code)
+        return fast, slow
+
+    def assertSameContent(self, url):
+        fast, slow = self.get_both(url)
+        self.assertEqual(fast.status_code, 200)
+        self.assertEqual(fast.content, slow.content)
+        return fast
+
+    def test_product_lists_are_identical(self):
+        for query in [
+            "",
+            "ordering=-unit_price",
+            f"collection_id={self.collection.id}",
+            "search=product",
+            "unit_price__gt=15",
+        ]:
+            for mode in ["", "pagination=keyset"]:
+                url = "/store/product/?" + "&".join(filter(None, [query, mode]))
+                with self.subTest(url=url):
+                    response = self.assertSameContent(url)
+                    self.assertSameContent(response.data["next"])
+
+    def test_product_detail_is_identical(self):
+        self.assertSameContent(f"/store/product/{self.products[3].id}/")
+
+    def test_collection_list_and_detail_are_identical(self):
+        self.assertSameContent("/store/collection/")
+        self.assertSameContent(f"/store/collection/{self.collection.id}/")
+
+    def test_missing_product_is_not_found(self):
+        for url in ["/store/product/0/", "/store/product/abc/"]:
+            with self.subTest(url=url):
+                fast, _ = self.get_both(url)
+                self.assertEqual(fast.status_code, 404)
+
+
+class PaginationModeTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title="C")
+        cls.products = [create_product(collection, f"P{i:02}") for i in range(12)]
+        user = get_user_model().objects.create_user(
+            username="user", email="user@example.com"
+        )
+        cls.user = user
+        create_orders(Customer.objects.get(user=user), cls.products[:1], 12)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_product_list_keeps_page_numbers_by_default(self):
+        response = self.client.get("/store/product/")
+
+        self.assertEqual(response.data["count"], 12)
+        self.assertIn("page=2", response.data["next"])
+
+    def test_keyset_pages_on_request(self):
+        response = self.client.get("/store/product/?pagination=keyset")
+        self.assertNotIn("count", response.data)
+        self.assertIn("cursor=", response.data["next"])
+
+        response = self.client.get(response.data["next"])
+        self.assertEqual(
+            [product["title"] for product in response.data["results"]],
+            ["P10", "P11"],
+        )
+        self.assertIsNone(response.data["next"])
+
+    def test_order_list_is_an_array_unless_keyset_is_asked_for(self):
+        self.client.force_authenticate(self.user)
+
+        response = self.client.get("/store/order/")
+        self.assertEqual(len(response.data), 12)
+
+        response = self.client.get("/store/order/?pagination=keyset")
+        self.assertEqual(len(response.data["results"]), 10)
+        self.assertIsNotNone(response.data["next"])
+
+
+# Catalog routes as served under ASGI (ASYNC_CATALOG_READS), for AsyncReadTests
+urlpatterns = [path("store/", include(async_read_urls(store_urls.urlpatterns)))]
+
+
+@override_settings(ROOT_URLCONF=__name__, ALLOWED_HOSTS=["testserver"])
+class AsyncReadTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title="C")
+        cls.product = create_product(collection)
+        for i in range(12):
+            Review.objects.create(product=cls.product, name=f"R{i}", description="-")
+            create_product(collection, f"P{i}")
+
+    def setUp(self):
+        cache.clear()
+
+    async def test_reads_match_the_sync_views(self):
+        for url in [
+            "/store/product/",
+            "/store/product/?page=2",
+            "/store/product/?page=last",
+            "/store/product/?page=3",
+            "/store/product/?pagination=keyset",
+            f"/store/product/{self.product.id}/",
+            "/store/collection/",
+            f"/store/product/{self.product.id}/review/",
+            f"/store/product/{self.product.id}/review/?pagination=keyset",
+            "/store/product/0/",
+        ]:
+            with self.subTest(url=url):
+                response = await self.async_client.get(url)
+                cache.clear()
+                with override_settings(ROOT_URLCONF="storefront.urls"):
+                    expected = await sync_to_async(self.client.get)(url)
+                self.assertEqual(response.status_code, expected.status_code)
+                self.assertEqual(response.content, expected.content)
+
+    async def test_writes_fall_back_to_the_sync_views(self):
+        response = await self.async_client.post("/store/product/", {})
+        self.assertEqual(response.status_code, 401)
+
+    async def test_page_numbers_are_counted_on_the_async_orm(self):
+        with mock.patch.object(
+            DefaultPagination, "paginate_queryset", side_effect=AssertionError
+        ):
+            response = await self.async_client.get("/store/product/?page=2")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["count"], 13)
+        self.assertEqual(len(response.json()["results"]), 3)
+
+    async def test_cache_is_not_used_on_the_event_loop(self):
+        loop_thread = threading.current_thread()
+        on_loop = []
+
+        def record(method):
+            def wrapper(*args, **kwargs):
+                on_loop.append(threading.current_thread() is loop_thread)
+                return method(*args, **kwargs)
+
+            return wrapper
+
+        methods = ["get", "set", "add", "get_many"]
+        with contextlib.ExitStack() as stack:
+            for name in methods:
+                method = getattr(LocMemCache, name)
+                stack.enter_context(
+                    mock.patch.object(LocMemCache, name, record(method))
+                )
+            for _ in range(2):
+                response = await self.async_client.get("/store/product/")
+                self.assertEqual(response.status_code, 200)
+
+        self.assertTrue(on_loop)
+        self.assertNotIn(True, on_loop)
+
+
+@override_settings(REPLICA_DATABASES=["replica"])
+class ReplicaRoutingTests(SimpleTestCase):
+    def setUp(self):
+        self.router = ReplicaRouter()
+        self.factory = RequestFactory()
+
+    def test_catalog_reads_go_to_a_replica(self):
+        request = self.factory.get("/store/product/")
+        self.assertTrue(reads_from_replica(request))
+        with replica_reads(reads_from_replica(request)):
+            self.assertEqual(self.router.db_for_read(Product), "replica")
+            with pin_primary():
+                self.assertIsNone(self.router.db_for_read(Product))
+            self.assertEqual(self.router.db_for_write(Product), "default")
+
+    def test_writes_other_views_and_pinned_clients_use_the_primary(self):
+        pinned = str(time.time() + 60)
+        for request in [
+            self.factory.post("/store/product/"),
+            self.factory.get("/store/order/"),
+            self.factory.get("/store/product/", HTTP_X_PIN_PRIMARY_UNTIL=pinned),
+        ]:
+            with self.subTest(request=request):
+                self.assertFalse(reads_from_replica(request))
+
+
+# The router sends nothing to a replica inside a transaction
+class ReplicaCachingTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = create_product(Collection.objects.create(title="C"))
+        self.user = get_user_model().objects.create_user(
+            username="user", email="user@example.com"
+        )
+        self.client = APIClient()
+
+    def get(self, url):
+        routed, db_for_read = [], ReplicaRouter.db_for_read
+
+        def record(router, model, **hints):
+            routed.append(db_for_read(router, model, **hints))
+            return routed[-1]
+
+        # "default" stands in for the replica, the router's answer tells them
+        # apart. Only during the request, as flush skips replicas.
+        with self.settings(REPLICA_DATABASES=["default"]), mock.patch.object(
+            ReplicaRouter, "db_for_read", record
+        ):
+            response = self.client.get(url)
+        return response, [alias for alias in routed if alias is not None]
+
+    def test_cached_responses_are_read_from_the_primary(self):
+        for url in ["/store/product/", f"/store/product/{self.product.id}/"]:
+            with self.subTest(url=url):
+                response, replica_reads = self.get(url)
+
+                self.assertEqual(replica_reads, [])
+                self.assertIn("ETag", response)
+
+    def test_uncached_replica_reads_get_no_validators(self):
+        self.client.force_authenticate(self.user)
+
+        response, replica_reads = self.get("/store/product/")
+
+        self.assertNotEqual(replica_reads, [])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("ETag", response)
+        self.assertNotIn("Last-Modified", response)
+
+
+class MetricsTests(APITestCase):
+    def sample(self, name, view):
+        return REGISTRY.get_sample_value(name, {"view": view}) or 0
+
+    def test_requests_are_recorded_per_route(self):
+        Collection.objects.create(title="C")
+        cache.clear()
+        requests = self.sample("storefront_request_queries_count", "collection-list")
+        queries = self.sample("storefront_request_queries_sum", "collection-list")
+
+        self.client.get("/store/collection/")
+
+        self.assertEqual(
+            self.sample("storefront_request_queries_count", "collection-list"),
+            requests + 1,
+        )
+        self.assertGreater(
+            self.sample("storefront_request_queries_sum", "collection-list"), queries
+        )
+        self.assertGreater(
+            self.sample("storefront_response_size_bytes_sum", "collection-list"), 0
+        )
+
+    def test_metrics_are_served_to_allowed_addresses_only(self):
+        response = self.client.get("/metrics/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"storefront_request_duration_seconds", response.content)
+
+        response = self.client.get("/metrics/", REMOTE_ADDR="10.0.0.1")
+        self.assertEqual(response.status_code, 404)
+
+
+class CatalogTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        promotions = [
+            Promotion.objects.create(description=f"Promo {i}", discount=0.1 * i)
+            for i in range(1, 3)
+        ]
+        collections = [Collection.objects.create(title=f"C{i}") for i in range(2)]
+        for i in range(5):
+            product = create_product(
+                collections[i % 2],
+                f"Café {i}",
+                Decimal("9.99") + i,
+                description=f"Line one\nline, two {i}",
+            )
+            product.promotions.set(promotions[: i % 3])
+        collections[0].featured_product = product
+        collections[0].save()
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def catalog(self):
+        return {
+            "promotions": list(
+                Promotion.objects.order_by("id").values("id", "description", "discount")
+            ),
+            "collections": list(
+                Collection.objects.order_by("id").values(
+                    "id", "title", "featured_product_id", "products_count"
+                )
+            ),
+            "products": [
+                (
+                    product.id,
+                    product.title,
+                    product.slug,
+                    product.description,
+                    product.unit_price,
+                    product.inventory,
+                    product.collection_id,
+                    sorted(promotion.id for promotion in product.promotions.all()),
+                )
+                for product in Product.objects.order_by("id").prefetch_related(
+                    "promotions"
+                )
+            ],
+        }
+
+    def test_round_trip(self):
+        expected = self.catalog()
+        for format in ["csv", "jsonl"]:
+            with self.subTest(format=format):
+                call_command(
+                    "export_catalog",
+                    self.directory,
+                    format=format,
+                    batch_size=2,
+                    stdout=StringIO(),
+                )
+                Product.objects.all().delete()
+                Collection.objects.all().delete()
+                Promotion.objects.all().delete()
+
+                call_command(
+                    "import_catalog",
+                    self.directory,
+                    format=format,
+                    batch_size=2,
+                    stdout=StringIO(),
+                )
+
+                self.assertEqual(self.catalog(), expected)
+                self.assertEqual(
+                    set(ProductSearchToken.objects.values_list("term", flat=True)),
+                    {"cafe", "line", "one", "two", "0", "1", "2", "3", "4"},
+                )
+
+    def test_export_pages_by_id(self):
+        with CaptureQueriesContext(connection) as queries:
+            call_command(
+                "export_catalog", self.directory, batch_size=2, stdout=StringIO()
+            )
+
+        with open(f"{self.directory}/products.csv", newline="") as file:
+            rows = list(csv.DictReader(file))
+        self.assertEqual(
+            [int(row["id"]) for row in rows],
+            list(Product.objects.order_by("id").values_list("id", flat=True)),
+        )
+        product_pages = [
+            query["sql"]
+            for query in queries
+            if query["sql"].startswith('SELECT "store_product"."id"')
+        ]
+        # 2 + 2 + 1 rows
+        self.assertEqual(len(product_pages), 3)
+        self.assertIn('"store_product"."id" >', product_pages[1])
+
+    def test_rows_without_ids_are_appended(self):
+        last = Product.objects.order_by("-id").first()
+        with open(f"{self.directory}/products.jsonl", "w") as file:
+            for product in [
+                {"id": last.id, "title": "Renamed", "unit_price": "1.00"},
+                {"title": "New", "unit_price": "2.50"},
+            ]:
+                product.update(inventory=1, collection="C1")
+                file.write(json.dumps(product) + "\n")
+
+        call_command(
+            "import_catalog", self.directory, format="jsonl", stdout=StringIO()
+        )
+
+        self.assertEqual(Product.objects.get(pk=last.id).title, "Renamed")
+        new = Product.objects.get(title="New")
+        self.assertEqual(new.id, last.id + 1)
+        self.assertEqual(new.slug, "new")
+        self.assertEqual(new.collection.title, "C1")
+
+    def test_import_resets_id_sequences(self):
+        call_command("export_catalog", self.directory, stdout=StringIO())
+
+        with mock.patch.object(
+            connection.ops, "sequence_reset_sql", return_value=[]
+        ) as sequence_reset_sql:
+            call_command("import_catalog", self.directory, stdout=StringIO())
+
+        sequence_reset_sql.assert_called_once_with(
+            mock.ANY, (Promotion, Collection, Product)
+        )
+
+    def test_invalid_row(self):
+        with open(f"{self.directory}/products.csv", "w") as file:
+            file.write("title,unit_price,inventory,collection\nP,1.00,1,Unknown\n")
+
+        with self.assertRaisesMessage(CommandError, "products.csv, line 2"):
+            call_command("import_catalog", self.directory, stdout=StringIO())
+
+
+class GenerateDataTests(APITestCase):
+    def generate(self, **options):
+        call_command("generate_data", stdout=StringIO(), **options)
+
+    def test_generated_rows_are_consistent(self):
+        self.generate(products=50, customers=10, batch_size=7)
+
+        self.assertEqual(Product.objects.count(), 50)
+        self.assertEqual(get_user_model().objects.count(), 10)
+        self.assertEqual(Customer.objects.count(), 10)
+        self.assertEqual(Order.objects.count(), 30)
+        self.assertFalse(
+            OrderItem.objects.exclude(unit_price=F("product__unit_price")).exists()
+        )
+        self.assertFalse(
+            Collection.objects.annotate(count=Count("products"))
+            .exclude(products_count=F("count"))
+            .exists()
+        )
+        self.assertEqual(Product.objects.filter(search_tokens__isnull=True).count(), 0)
+
+    def test_same_seed_gives_the_same_rows(self):
+        def snapshot():
+            return (
+                list(
+                    Product.objects.values_list("title", "unit_price", "collection_id")
+                ),
+                list(Order.objects.values_list("customer_id", "placed_at")),
+                list(Cart.objects.values_list("id", flat=True)),
+            )
+
+        self.generate(products=20, customers=5, seed=7)
+        first = snapshot()
+        for model in [CartItem, Cart, OrderItem, Order, Review, Product]:
+            model.objects.all().delete()
+        Collection.objects.all().delete()
+        Customer.objects.all().delete()
+        get_user_model().objects.all().delete()
+
+        self.generate(products=20, customers=5, seed=7)
+        self.assertEqual(snapshot(), first)
+
+    def test_resets_id_sequences(self):
+        with mock.patch.object(
+            connection.ops, "sequence_reset_sql", return_value=[]
+        ) as sequence_reset_sql:
+            self.generate(products=5, customers=2)
+
+        sequence_reset_sql.assert_called_once_with(
+            mock.ANY, (Collection, Product, get_user_model(), Customer, Order)
+        )
+
+
+# Small enough that reading them whole is the right plan
+SCANNABLE_TABLES = {"store_collection", "store_promotion", "django_content_type"}
+
+
+def full_scans(sql):
+    """The tables EXPLAIN says `sql` reads without an index."""
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            cursor.execute("EXPLAIN QUERY PLAN " + sql)
+            details = [row[3] for row in cursor.fetchall()]
+            # "SCAN store_product", but not "SCAN store_product USING INDEX ..."
+            tables = [d.split()[1] for d in details if re.fullmatch(r"SCAN \S+", d)]
+        else:
+            cursor.execute("EXPLAIN " + sql)
+            columns = [column[0] for column in cursor.description]
+            rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            tables = [row["table"] for row in rows if row["type"] == "ALL"]
+    return [table for table in tables if table not in SCANNABLE_TABLES]
+
+
+class RunBenchmarkTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title="C")
+        for i in range(3):
+            create_product(collection, f"Product {i}")
+        User = get_user_model()
+        User.objects.create_user(
+            username="admin", email="admin@example.com", is_staff=True
+        )
+        User.objects.create_user(username="user", email="user@example.com")
+
+    @override_settings(ALLOWED_HOSTS=["localhost"])
+    def test_leaves_the_shared_cache_alone(self):
+        cache.set("other", 1)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        call_command(
+            "run_benchmark",
+            requests=30,
+            warmup=0,
+            baseline=f"{directory.name}/baseline.json",
+            save_baseline=True,
+            stdout=StringIO(),
+        )
+
+        self.assertEqual(cache.get("other"), 1)
+        with open(f"{directory.name}/baseline.json") as file:
+            endpoints = json.load(file)["endpoints"]
+        self.assertIn("product-list", endpoints)
+
+    def test_tokens_carry_the_login_claims(self):
+        user = get_user_model().objects.get(username="user")
+
+        token = AccessToken(Command().access_token(user))
+
+        self.assertEqual(token["customer_id"], user.customer.id)
+        self.assertIn("auth_digest", token)
+
+
+class QueryPlanTests(APITestCase):
+    """Every query of the hot paths must be able to use an index."""
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.admin = User.objects.create_user(
+            username="admin", email="admin@example.com", is_staff=True
+        )
+        cls.user = User.objects.create_user(username="user", email="user@example.com")
+        collection = Collection.objects.create(title="C")
+        cls.products = [
+            create_product(collection, f"P{i}", Decimal(10 + i)) for i in range(5)
+        ]
+        create_orders(Customer.objects.get(user=cls.user), cls.products[:2], 2)
+
+    def setUp(self):
+        cache.clear()
+
+    def assertUsesIndexes(self, run):
+        with CaptureQueriesContext(connection) as queries:
+            response = run()
+        self.assertLess(response.status_code, 500)
+        selects = [q["sql"] for q in queries if q["sql"].startswith("SELECT")]
+        self.assertTrue(selects)
+        for sql in selects:
+            with self.subTest(sql=sql):
+                self.assertEqual(full_scans(sql), [])
+
+    def test_product_list(self):
+        collection_id = self.products[0].collection_id
+        for url in [
+            "/store/product/",
+            f"/store/product/?collection_id={collection_id}&unit_price__gt=11",
+            "/store/product/?unit_price__lt=12&ordering=unit_price",
+        ]:
+            with self.subTest(url=url):
+                self.assertUsesIndexes(lambda: self.client.get(url))
+
+    def test_product_search(self):
+        for url in ["/store/product/?search=p1", "/store/product/?search=p"]:
+            with self.subTest(url=url):
+                self.assertUsesIndexes(lambda: self.client.get(url))
+
+    def test_product_destroy_checks_order_items(self):
+        self.client.force_authenticate(self.admin)
+        url = f"/store/product/{self.products[0].id}/"
+        self.assertUsesIndexes(lambda: self.client.delete(url))
+
+    def test_customer_orders(self):
+        self.client.force_authenticate(self.user)
+        self.assertUsesIndexes(lambda: self.client.get("/store/order/"))
+
+    def test_order_export_by_period(self):
+        self.client.force_authenticate(self.admin)
+        url = (
+            "/store/order/export/"
+            "?placed_at__gte=2024-01-01T00:00:00Z&placed_at__lt=2100-01-01T00:00:00Z"
+        )
+
+        def export():
+            response = self.client.get(url)
+            b"".join(response.streaming_content)
+            return response
+
+        self.assertUsesIndexes(export)
+
+    def test_old_carts_and_tagged_items(self):
+        Cart.objects.create()
+        tag = Tag.objects.create(label="t")
+        content_type = ContentType.objects.get_for_model(Product)
+        TaggedItem.objects.create(
+            tag=tag, content_type=content_type, object_id=self.products[0].id
+        )
+
+        for queryset in [
+            Cart.objects.filter(created_at__lt="2024-01-01T00:00:00Z"),
+            TaggedItem.objects.filter(
+                content_type=content_type, object_id=self.products[0].id
+            ),
+        ]:
+            with self.subTest(model=queryset.model):
+                sql, params = queryset.query.sql_with_params()
+                with connection.cursor() as cursor:
+                    sql = connection.ops.last_executed_query(cursor, sql, params)
+                self.assertEqual(full_scans(sql), [])
+
+
+class CustomerIdClaimTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(
+            username="user", email="user@example.com", password="secret-password"
+        )
+        cls.customer = Customer.objects.get(user=cls.user)
+        collection = Collection.objects.create(title="C")
+        product = create_product(collection)
+        create_orders(cls.customer, [product], 2)
+
+    def setUp(self):
+        share_cache(self)
+        cache.clear()
+        user_cache.clear()
+
+    def get_orders(self, token):
+        self.client.credentials(HTTP_AUTHORIZATION=f"JWT {token}")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/store/order/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 2)
+        return len(queries)
+
+    def test_issued_tokens_carry_the_customer_id(self):
+        response = self.client.post(
+            "/auth/jwt/create/",
+            {"username": "user", "password": "secret-password"},
+        )
+        access = AccessToken(response.data["access"])
+        self.assertEqual(access["customer_id"], self.customer.id)
+
+        refreshed = self.client.post(
+            "/auth/jwt/refresh/", {"refresh": response.data["refresh"]}
+        )
+        access = AccessToken(refreshed.data["access"])
+        self.assertEqual(access["customer_id"], self.customer.id)
+
+        # Orders, items and products, the user comes from the token
+        self.assertEqual(self.get_orders(access), 3)
+
+    def test_tokens_without_the_claim_look_the_customer_up_once(self):
+        token = AccessToken.for_user(self.user)
+
+        # The user and their permissions, the customer id, then the orders
+        self.assertEqual(self.get_orders(token), 7)
+        self.assertEqual(self.get_orders(token), 3)
+
+
+@override_settings(ADMIN_ESTIMATED_COUNT_THRESHOLD=3)
+class EstimatedCountAdminTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = get_user_model().objects.create_superuser(
+            username="admin", email="admin@example.com", password="secret-password"
+        )
+        collections = [Collection.objects.create(title=f"C{i}") for i in range(2)]
+        for i in range(5):
+            create_product(collections[i // 4], f"P{i}", Decimal(10 + i))
+        cls.collection = collections[0]
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.admin)
+
+    def get_changelist(self, query=""):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/admin/store/product/" + query)
+        self.assertEqual(response.status_code, 200)
+        counts = [q["sql"] for q in queries if "COUNT(" in q["sql"]]
+        return response.content.decode(), counts
+
+    def test_large_tables_are_not_counted(self):
+        self.get_changelist()
+        content, counts = self.get_changelist()
+
+        self.assertEqual(counts, [])
+        self.assertIn("About 5 products", " ".join(content.split()))
+
+    def test_filtered_counts_stop_at_the_threshold(self):
+        content, _ = self.get_changelist(f"?collection__id__exact={self.collection.id}")
+
+        self.assertIn("More than 3 products", " ".join(content.split()))
+
+    def test_exact_count_on_request(self):
+        content, counts = self.get_changelist("?exact_count=1")
+
+        self.assertEqual(len(counts), 1)
+        self.assertIn("5 products", content)
+        self.assertNotIn("About", content)
+
+
+class ExportCsvAdminTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = get_user_model().objects.create_superuser(
+            username="admin", email="admin@example.com", password="secret-password"
+        )
+        collection = Collection.objects.create(title="Snacks")
+        cls.products = [
+            create_product(collection, f"P{i}", Decimal(10 + i), inventory=i)
+            for i in range(4)
+        ]
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def export(self, url, selected, **data):
+        response = self.client.post(
+            url,
+            {"action": "export_csv", "index": 0, "_selected_action": selected, **data},
+        )
+        self.assertEqual(response["Content-Type"], "text/csv")
+        with CaptureQueriesContext(connection) as queries:
+            content = b"".join(response.streaming_content).decode()
+        return list(csv.reader(content.splitlines())), len(queries)
+
+    def test_selected_products(self):
+        rows, queries = self.export(
+            "/admin/store/product/", [self.products[1].id, self.products[2].id]
+        )
+
+        self.assertEqual(rows[0][:2], ["id", "title"])
+        self.assertEqual(sorted(row[1] for row in rows[1:]), ["P1", "P2"])
+        self.assertEqual(rows[1][5], "Snacks")
+        # Collections come with the products
+        self.assertEqual(queries, 1)
+
+    def test_all_matching_orders(self):
+        customer = Customer.objects.get(user=self.admin)
+        create_orders(customer, self.products[:1], 3)
+        order = Order.objects.first()
+
+        rows, queries = self.export(
+            "/admin/store/order/?payment_status__exact=P",
+            [order.id],
+            select_across=1,
+        )
+
+        self.assertEqual(len(rows), 4)
+        self.assertEqual({row[4] for row in rows[1:]}, {"admin@example.com"})
+        self.assertEqual(queries, 1)
+
+    def test_pages_by_id(self):
+        with mock.patch.object(ProductAdmin, "csv_chunk_size", 2):
+            rows, queries = self.export(
+                "/admin/store/product/", [self.products[0].id], select_across=1
+            )
+
+        self.assertEqual(
+            [int(row[0]) for row in rows[1:]], [p.id for p in self.products]
+        )
+        # Two full pages and an empty one
+        self.assertEqual(queries, 3)
+
+    def test_formulas_are_quoted(self):
+        Product.objects.filter(id=self.products[0].id).update(
+            title='=HYPERLINK("http://example.com")'
+        )
+        Product.objects.filter(id=self.products[1].id).update(title="-1+2")
+
+        rows, _ = self.export(
+            "/admin/store/product/", [self.products[0].id, self.products[1].id]
+        )
+
+        self.assertEqual(
+            [row[1] for row in rows[1:]],
+            ['\'=HYPERLINK("http://example.com")', "'-1+2"],
+        )
+        self.assertEqual(rows[1][3], "10.00")
+
+    def test_customers_are_exported_without_order_counts(self):
+        customer = Customer.objects.get(user=self.admin)
+        create_orders(customer, self.products[:1], 2)
+
+        response = self.client.post(
+            "/admin/store/customer/",
+            {
+                "action": "export_csv",
+                "index": 0,
+                "_selected_action": [customer.id],
+                "select_across": 1,
+            },
+        )
+        with CaptureQueriesContext(connection) as queries:
+            content = b"".join(response.streaming_content).decode()
+
+        self.assertIn("admin@example.com", content)
+        self.assertNotIn("GROUP BY", queries[0]["sql"])
+
+        response = self.client.get("/admin/store/customer/")
+        self.assertContains(response, f'?customer__id={customer.id}">2</a>')
@@ -4,9 +4,14 @@ from .views import (
     ReviewViewSet,
     CartViewSet,
     CartItemViewSet,
+    CachedCartViewSet,
+    CachedCartItemViewSet,
     CustomerViewSet,
     OrderViewSet,
 )
+from django.conf import settings
+from .async_views import async_read_urls
+from .carts import cache_enabled
 from rest_framework_nested.routers import (
     NestedSimpleRouter,
     NestedDefaultRouter,
@@ -14,13 +19,17 @@ from rest_framework_nested.routers import (
     DefaultRouter,
 )
 
+# Same URLs and serializers either way, see store.carts
+if cache_enabled():
+    CartViewSet, CartItemViewSet = CachedCartViewSet, CachedCartItemViewSet
+
 router = DefaultRouter()
 
 router.register("product", ProductViewSet, basename="product")
 router.register("collection", CollectionViewSet)
-router.register("cart", CartViewSet)
+router.register("cart", CartViewSet, basename="cart")
 router.register("customer", CustomerViewSet, basename="customer")
-router.register("cart", CartViewSet)
+router.register("cart", CartViewSet, basename="cart")
 router.register("order", OrderViewSet, basename="order")
 
 product_router = NestedDefaultRouter(router, "product", lookup="product")
@@ -30,3 +39,7 @@ cart_router = NestedDefaultRouter(router, "cart", lookup="cart")
 cart_router.register("cartitems", CartItemViewSet, basename="cart-cartitems")
 
 urlpatterns = router.urls + product_router.urls + cart_router.urls
+
+# Under ASGI catalog reads use the async ORM, see store.async_views
+if getattr(settings, "ASYNC_CATALOG_READS", False):
+    urlpatterns = async_read_urls(urlpatterns)
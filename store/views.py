@@ -1,5 +1,6 @@
-from django.shortcuts import render
-from django.http import HttpRequest
+from django.shortcuts import get_object_or_404, render
+import json
+from django.http import HttpRequest, StreamingHttpResponse
 from .models import (
     Product,
     Order,
@@ -11,12 +12,14 @@ from .models import (
     Cart,
     CartItem,
 )
-from django.db.models import Q, F, Value, Func, ExpressionWrapper, DecimalField
+from django.db.models import Q, F, Value, Func, ExpressionWrapper, DecimalField, Prefetch
 from django.db.models.functions import Concat
 from django.db.models.aggregates import Count, Max, Min, Sum
 from django.db import transaction
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
+from rest_framework.exceptions import ValidationError
+from rest_framework.utils.encoders import JSONEncoder
 from rest_framework.views import APIView
 from rest_framework.generics import ListCreateAPIView, RetrieveUpdateDestroyAPIView
 from rest_framework.permissions import (
@@ -27,7 +30,7 @@ from rest_framework.permissions import (
     DjangoModelPermissionsOrAnonReadOnly,
 )
 from rest_framework.viewsets import ModelViewSet, GenericViewSet
-from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.filters import OrderingFilter
 from rest_framework.mixins import (
     CreateModelMixin,
     RetrieveModelMixin,
@@ -52,8 +55,15 @@ from .serializers import (
     OrderUpdateSerializer,
 )
 from rest_framework.pagination import PageNumberPagination
-from .filters import ProductFilter
-from .pagination import DefaultPagination
+from .filters import OrderFilter, ProductFilter
+from .search import ProductSearchFilter
+from .pagination import OptionalKeysetPagination, PageNumberOrKeysetPagination
+from .caching import CachedResponseMixin, ConditionalResponseMixin
+from .fastpath import FastReadMixin, ReadPlan
+from .bulk import batches_by_id
+from core.authentication import StatelessJWTAuthentication
+from . import carts
+from .customers import get_customer_id
 from .permissions import (
     IsAdminOrReadOnly,
     FullDjangoModelPermissions,
@@ -61,16 +71,25 @@ from .permissions import (
 )
 
 
-class ProductViewSet(ModelViewSet):
-    queryset = Product.objects.all()
+class ProductViewSet(
+    ConditionalResponseMixin, CachedResponseMixin, FastReadMixin, ModelViewSet
+):
+    queryset = Product.objects.with_price_with_tax()
     serializer_class = ProductSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [DjangoFilterBackend, ProductSearchFilter, OrderingFilter]
     # filterset_fields = ["collection_id"]
     filterset_class = ProductFilter
-    pagination_class = DefaultPagination
+    pagination_class = PageNumberOrKeysetPagination
+    keyset_ordering = "title"
     search_fields = ["title"]
     ordering_fields = ["unit_price"]
+    authentication_classes = [StatelessJWTAuthentication]
     permission_classes = [IsAdminOrReadOnly]
+    cache_models = [Product, Collection, Promotion]
+    replica_reads = True
+    read_plan = ReadPlan(
+        ProductSerializer, columns={"price_with_tax": "price_with_tax"}
+    )
 
     def get_serializer_context(self):
         return {"request": self.request}
@@ -86,17 +105,27 @@ class ProductViewSet(ModelViewSet):
         return super().destroy(request, *args, **kwargs)
 
 
-class CollectionViewSet(ModelViewSet):
-    queryset = Collection.objects.annotate(products_count=Count("products"))
+class CollectionViewSet(
+    ConditionalResponseMixin, CachedResponseMixin, FastReadMixin, ModelViewSet
+):
+    queryset = Collection.objects.all()
     serializer_class = CollectionSerializer
+    authentication_classes = [StatelessJWTAuthentication]
     permission_classes = [IsAdminOrReadOnly]
+    cache_models = [Collection, Product]
+    replica_reads = True
+    read_plan = ReadPlan(CollectionSerializer)
 
     def get_serializer_context(self):
         return {"request": self.request}
 
 
-class ReviewViewSet(ModelViewSet):
+class ReviewViewSet(FastReadMixin, ModelViewSet):
     serializer_class = ReviewSerializer
+    pagination_class = OptionalKeysetPagination
+    authentication_classes = [StatelessJWTAuthentication]
+    read_plan = ReadPlan(ReviewSerializer)
+    replica_reads = True
 
     def get_queryset(self):
         return Review.objects.filter(product_id=self.kwargs["product_pk"])
@@ -114,15 +143,17 @@ class CartViewSet(
 
         return CartSerializer
 
-    queryset = Cart.objects.prefetch_related("cartitems__product").all()
+    queryset = Cart.objects.with_totals()
 
 
 class CartItemViewSet(ModelViewSet):
     http_method_names = ["get", "post", "patch", "delete"]
 
     def get_queryset(self):
-        return CartItem.objects.filter(cart_id=self.kwargs["cart_pk"]).select_related(
-            "product"
+        return (
+            CartItem.objects.with_total_price()
+            .filter(cart_id=self.kwargs["cart_pk"])
+            .select_related("product")
         )
 
     def get_serializer_context(self):
@@ -137,9 +168,85 @@ class CartItemViewSet(ModelViewSet):
         return CartItemReadSerializer
 
 
+class CachedCartViewSet(GenericViewSet):
+    """
+    CartViewSet with the cart kept in the cache (CART_STORAGE = "cache"),
+    see store.carts.
+    """
+
+    def get_serializer_class(self):
+        if self.request.method == "POST":
+            return CreateCartSerializer
+
+        return CartSerializer
+
+    def create(self, request, *args, **kwargs):
+        cart = carts.create_cart()
+        return Response(CreateCartSerializer(cart).data, status=201)
+
+    def retrieve(self, request, pk):
+        cart = carts.get_cart(pk)
+        serializer = CartSerializer(cart, context=self.get_serializer_context())
+        return Response(serializer.data)
+
+    def destroy(self, request, pk):
+        carts.delete_cart(pk)
+        return Response(status=204)
+
+
+class CachedCartItemViewSet(GenericViewSet):
+    """
+    CartItemViewSet with the cart kept in the cache (CART_STORAGE = "cache").
+    Items are addressed by product id.
+    """
+
+    http_method_names = ["get", "post", "patch", "delete"]
+
+    def get_serializer_context(self):
+        return {"cart_id": self.kwargs["cart_pk"]}
+
+    def get_serializer_class(self):
+        if self.request.method == "POST":
+            return CartItemCreateSerializer
+        elif self.request.method == "PATCH":
+            return CartItemUpdateSerializer
+
+        return CartItemReadSerializer
+
+    def list(self, request, cart_pk):
+        cart = carts.get_cart(cart_pk)
+        serializer = CartItemReadSerializer(cart.cartitems.all(), many=True)
+        return Response(serializer.data)
+
+    def retrieve(self, request, cart_pk, pk):
+        item = carts.get_item(carts.get_cart(cart_pk), pk)
+        return Response(CartItemReadSerializer(item).data)
+
+    def create(self, request, cart_pk):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        item = carts.add_item(
+            cart_pk,
+            serializer.validated_data["product"].id,
+            serializer.validated_data["quantity"],
+        )
+        return Response(CartItemCreateSerializer(item).data, status=201)
+
+    def partial_update(self, request, cart_pk, pk):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        item = carts.set_quantity(cart_pk, pk, serializer.validated_data["quantity"])
+        return Response(CartItemUpdateSerializer(item).data)
+
+    def destroy(self, request, cart_pk, pk):
+        carts.remove_item(cart_pk, pk)
+        return Response(status=204)
+
+
 class CustomerViewSet(ModelViewSet):
     queryset = Customer.objects.all()
     serializer_class = CustomerSerializer
+    authentication_classes = [StatelessJWTAuthentication]
     permission_classes = [IsAdminUser]  # Only Admin can perform all action
     # permission_classes = [DjangoModelPermissions]
     # permission_classes = [FullDjangoModelPermissions]
@@ -154,7 +261,7 @@ class CustomerViewSet(ModelViewSet):
     # detail = True means it will work on customer/1/me, False means it will work on customer/me
     @action(detail=False, methods=["GET", "PUT"], permission_classes=[IsAuthenticated])
     def me(self, request):
-        customer = Customer.objects.get(user_id=request.user.id)
+        customer = get_object_or_404(Customer, pk=get_customer_id(request))
 
         if request.method == "GET":
             serializer = CustomerSerializer(customer)
@@ -171,15 +278,19 @@ class CustomerViewSet(ModelViewSet):
 
 class OrderViewSet(ModelViewSet):
     http_method_names = ["get", "post", "patch", "delete", "head", "options"]
+    pagination_class = OptionalKeysetPagination
+    authentication_classes = [StatelessJWTAuthentication]
 
     def get_queryset(self):
+        # Items and their products come in one query each, the collection
+        # hyperlink on ProductSerializer only needs collection_id.
+        queryset = Order.objects.prefetch_related(
+            Prefetch("items__product", queryset=Product.objects.with_price_with_tax())
+        )
         user = self.request.user
         if user.is_staff:
-            return Order.objects.all()
-        customer_id = Customer.objects.only("id").get(
-            user_id=user.id
-        )
-        return Order.objects.filter(customer_id=customer_id)
+            return queryset
+        return queryset.filter(customer_id=get_customer_id(self.request))
 
     def get_serializer_class(self):
         if self.request.method == "POST":
@@ -190,14 +301,38 @@ class OrderViewSet(ModelViewSet):
 
     def create(self, request, *args, **kwargs):
         serializer = OrderCreateSerializer(
-            data=request.data, context={"user_id": self.request.user.id}
+            data=request.data, context={"customer_id": get_customer_id(request)}
         )
         serializer.is_valid(raise_exception=True)
         order = serializer.save()
-        serializer = OrderSerializer(order)
+        serializer = OrderSerializer(order, context=self.get_serializer_context())
         return Response(serializer.data)
 
     def get_permissions(self):
-        if self.request.method in ["PUT", "PATCH", "DELETE"]:
+        if self.action == "export" or self.request.method in ["PUT", "PATCH", "DELETE"]:
             return [IsAdminUser()]
         return [IsAuthenticated()]
+
+    export_chunk_size = 500
+
+    @action(detail=False)
+    def export(self, request):
+        """
+        All orders matching ?placed_at__gte=&placed_at__lt=&payment_status= as
+        newline delimited JSON, one order with its items per line.
+        """
+        filterset = OrderFilter(request.query_params, queryset=self.get_queryset())
+        if not filterset.is_valid():
+            raise ValidationError(filterset.errors)
+
+        # One query per page of orders plus its prefetches
+        pages = batches_by_id(filterset.qs, self.export_chunk_size)
+        context = self.get_serializer_context()
+
+        def lines():
+            for orders in pages:
+                for order in orders:
+                    data = OrderSerializer(order, context=context).data
+                    yield json.dumps(data, cls=JSONEncoder) + "\n"
+
+        return StreamingHttpResponse(lines(), content_type="application/x-ndjson")
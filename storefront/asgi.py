@@ -5,6 +5,9 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
+
+Run it with e.g.
+    gunicorn storefront.asgi:application -k uvicorn.workers.UvicornWorker
 """
 
 import os
@@ -12,5 +15,6 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'storefront.settings')
+os.environ.setdefault('ASYNC_CATALOG_READS', '1')
 
 application = get_asgi_application()
@@ -0,0 +1,28 @@
+"""
+Version counters, cached responses, auth digests and cached carts only work
+if every process serving requests sees the same cache (see CACHES in
+settings). A LocMemCache is shared by the threads of one process, enough for
+runserver and the tests, and the DummyCache stores nothing at all.
+"""
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+PROCESS_LOCAL_BACKENDS = {
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+}
+
+
+def is_process_local(alias="default"):
+    return settings.CACHES[alias]["BACKEND"] in PROCESS_LOCAL_BACKENDS
+
+
+def require_shared_cache(processes):
+    """Called before starting `processes` processes that serve requests."""
+    if processes > 1 and is_process_local():
+        raise ImproperlyConfigured(
+            f"{processes} worker processes need a cache they all share, "
+            f"{settings.CACHES['default']['BACKEND']} is per process. "
+            "Set REDIS_URL."
+        )
@@ -0,0 +1,130 @@
+"""
+Sends catalog reads to read replicas.
+
+ReplicaRoutingMiddleware turns replica reads on for GET/HEAD/OPTIONS
+requests to views whose viewset sets `replica_reads = True`, and
+ReplicaRouter then picks one of settings.REPLICA_DATABASES for every read
+in that request. Everything else, writes included, uses "default".
+
+Replicas lag behind, so a client that has just written something is pinned
+to the primary for REPLICA_PIN_SECONDS. For the same reason responses that
+are cached or get validators are read from the primary, see store.caching. The pin is sent back both as a
+cookie and as the X-Pin-Primary-Until header, for clients without cookies
+to echo.
+
+To try it locally, make a copy of a SQLite database and add it as a replica:
+
+    DATABASES = {
+        "default": {"ENGINE": "django.db.backends.sqlite3", "NAME": "primary.sqlite3"},
+        "replica": {"ENGINE": "django.db.backends.sqlite3", "NAME": "replica.sqlite3"},
+    }
+    REPLICA_DATABASES = ["replica"]
+"""
+
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.urls import Resolver404, resolve
+
+PIN_COOKIE = "pin_primary_until"
+PIN_HEADER = "X-Pin-Primary-Until"
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+use_replica = ContextVar("use_replica", default=False)
+
+
+@contextmanager
+def replica_reads(enabled=True):
+    token = use_replica.set(enabled)
+    try:
+        yield
+    finally:
+        use_replica.reset(token)
+
+
+def pin_primary():
+    """Reads inside the block go to the primary, whatever the request."""
+    return replica_reads(enabled=False)
+
+
+def reading_from_replica():
+    return bool(getattr(settings, "REPLICA_DATABASES", [])) and use_replica.get()
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replicas = getattr(settings, "REPLICA_DATABASES", [])
+        if not replicas or not use_replica.get():
+            return None
+        # Inside a transaction, reads must see its own writes
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in getattr(settings, "REPLICA_DATABASES", [])
+
+
+def get_pinned_until(request):
+    value = request.COOKIES.get(PIN_COOKIE) or request.headers.get(PIN_HEADER)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def reads_from_replica(request):
+    if request.method not in SAFE_METHODS or get_pinned_until(request) > time.time():
+        return False
+    try:
+        match = resolve(request.path_info, getattr(request, "urlconf", None))
+    except Resolver404:
+        return False
+    viewset = getattr(match.func, "cls", None)
+    return getattr(viewset, "replica_reads", False)
+
+
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with replica_reads(reads_from_replica(request)):
+            response = self.get_response(request)
+        return self.pin(request, response)
+
+    async def __acall__(self, request):
+        with replica_reads(reads_from_replica(request)):
+            response = await self.get_response(request)
+        return self.pin(request, response)
+
+    def pin(self, request, response):
+        if (
+            not getattr(settings, "REPLICA_DATABASES", [])
+            or request.method in SAFE_METHODS
+            or response.status_code >= 400
+        ):
+            return response
+        seconds = getattr(settings, "REPLICA_PIN_SECONDS", 5)
+        pinned_until = f"{time.time() + seconds:.3f}"
+        response.set_cookie(PIN_COOKIE, pinned_until, max_age=seconds, httponly=True)
+        response[PIN_HEADER] = pinned_until
+        return response
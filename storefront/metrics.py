@@ -0,0 +1,142 @@
+"""
+Per-route request metrics in Prometheus format.
+
+MetricsMiddleware records, for every request, its latency, number of SQL
+queries, time spent in SQL and response size, labelled with the resolved
+URL name (product-list, order-detail, ...). `metrics_view` serves them.
+
+Under gunicorn every worker writes its samples to PROMETHEUS_MULTIPROC_DIR
+(set up by config/gunicorn/prod.py) and the view adds up all workers.
+Without it, e.g. with runserver, the view reports the current process.
+"""
+
+import os
+import time
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import Http404, HttpResponse
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+REQUESTS = Counter(
+    "storefront_requests_total", "Requests", ["view", "method", "status"]
+)
+LATENCY = Histogram(
+    "storefront_request_duration_seconds",
+    "Time from the first middleware to the response",
+    ["view", "method"],
+)
+QUERIES = Histogram(
+    "storefront_request_queries",
+    "SQL queries per request",
+    ["view"],
+    buckets=[0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, float("inf")],
+)
+SQL_TIME = Histogram(
+    "storefront_request_sql_seconds", "Time spent in SQL per request", ["view"]
+)
+RESPONSE_SIZE = Histogram(
+    "storefront_response_size_bytes",
+    "Size of the response body, streamed responses excluded",
+    ["view"],
+    buckets=[256, 1024, 4096, 16384, 65536, 262144, 1048576, float("inf")],
+)
+
+
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+
+
+# Seen by the ORM in threads started with sync_to_async too
+current_stats = ContextVar("current_stats", default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    stats = current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.sql_time += time.perf_counter() - start
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    # Fired again on every reconnect of the same connection object
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+connection_created.connect(install_query_recorder)
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        # Connections opened before this module was imported
+        for connection in connections.all(initialized_only=True):
+            install_query_recorder(None, connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats, start = RequestStats(), time.perf_counter()
+        token = current_stats.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        self.observe(request, response, stats, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        stats, start = RequestStats(), time.perf_counter()
+        token = current_stats.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        self.observe(request, response, stats, time.perf_counter() - start)
+        return response
+
+    def observe(self, request, response, stats, duration):
+        match = getattr(request, "resolver_match", None)
+        view = match.view_name if match is not None else "<unresolved>"
+
+        REQUESTS.labels(view, request.method, response.status_code).inc()
+        LATENCY.labels(view, request.method).observe(duration)
+        QUERIES.labels(view).observe(stats.queries)
+        SQL_TIME.labels(view).observe(stats.sql_time)
+        if not response.streaming:
+            RESPONSE_SIZE.labels(view).observe(len(response.content))
+
+
+def metrics_view(request):
+    if request.META.get("REMOTE_ADDR") not in settings.METRICS_ALLOWED_IPS:
+        raise Http404
+
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
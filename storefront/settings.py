@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 from datetime import timedelta
 
@@ -48,7 +49,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "storefront.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
+    "storefront.db_routers.ReplicaRoutingMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -93,9 +96,68 @@ DATABASES = {
         "NAME": "storefront",
         "USER": "root",
         "PORT": "3306",
+        # 0 closes the connection after every request, production keeps it
+        # open (see config/gunicorn/prod.py)
+        "CONN_MAX_AGE": int(os.environ.get("DB_CONN_MAX_AGE", 0)),
+        "CONN_HEALTH_CHECKS": True,
     },
 }
 
+if DATABASES["default"]["ENGINE"] == "django.db.backends.sqlite3":
+    # An in-memory test database is one connection shared by every thread,
+    # tests that send requests concurrently need each thread to open its own
+    DATABASES["default"].setdefault("TEST", {}).setdefault(
+        "NAME", BASE_DIR / "test_db.sqlite3"
+    )
+
+# Who may scrape /metrics/ (see storefront/metrics.py), comma separated
+METRICS_ALLOWED_IPS = os.environ.get("METRICS_ALLOWED_IPS", "127.0.0.1").split(",")
+
+# Replicas of "default" for catalog reads, see storefront/db_routers.py
+REPLICA_DATABASES = []
+# How long a client that wrote something keeps reading from the primary
+REPLICA_PIN_SECONDS = 5
+DATABASE_ROUTERS = ["storefront.db_routers.ReplicaRouter"]
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Catalog responses and their version counters, auth digests and carts live
+# here (see store.caching, core.authentication and store.carts), so every
+# process serving requests must see the same cache (see storefront/caches.py).
+# A LocMemCache is only shared by the threads of one process, enough for
+# runserver and the tests.
+if os.environ.get("REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.environ["REDIS_URL"],
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+# "database" writes every cart change to store_cart/store_cartitem.
+# "cache" keeps live carts in the cache above and writes them out in batches
+# (manage.py flush_carts) and at checkout, see store.carts. Needs a cache
+# shared by all workers.
+CART_STORAGE = "database"
+CART_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+
+# Product, collection and review reads on the async ORM, see
+# store.async_views. Set by storefront/asgi.py, under WSGI every async view
+# would just be run in an event loop of its own.
+ASYNC_CATALOG_READS = os.environ.get("ASYNC_CATALOG_READS") == "1"
+
+if ASYNC_CATALOG_READS:
+    # The toolbar middleware is sync only, Django would hand every request
+    # to a thread to run it.
+    MIDDLEWARE.remove("debug_toolbar.middleware.DebugToolbarMiddleware")
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -164,8 +226,18 @@ REST_FRAMEWORK = {
 SIMPLE_JWT = {
     "AUTH_HEADER_TYPES": ("JWT",),
     "ACCESS_TOKEN_LIFETIME": timedelta(days=2),
+    # Adds the customer_id claim to the tokens from /auth/jwt/create/
+    "TOKEN_OBTAIN_SERIALIZER": "core.serializers.TokenObtainPairSerializer",
 }
 
+# Admin changelists estimate their count above this many rows, see
+# store.pagination.EstimatedCountPaginator
+ADMIN_ESTIMATED_COUNT_THRESHOLD = 100000
+
+# Full user objects each worker keeps for core.authentication
+AUTH_USER_CACHE_SIZE = 1024
+AUTH_USER_CACHE_TTL = 60
+
 DJOSER = {
     "SERIALIZERS": {
         "user_create": "core.serializers.UserCreateSerializer",
@@ -16,6 +16,7 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
+from .metrics import metrics_view
 
 admin.site.site_header = "Storefront Admin"
 admin.site.index_title = "Admin"
@@ -26,4 +27,5 @@ urlpatterns = [
     path("auth/", include("djoser.urls")),
     path("auth/", include("djoser.urls.jwt")),
     path("store/", include("store.urls")),
+    path("metrics/", metrics_view, name="metrics"),
 ]
@@ -0,0 +1,97 @@
+"""
+Work a fresh worker would otherwise do on its first requests: compiling the
+URL patterns, building serializer fields and read plans and connecting to
+the database. warm_up() is called by the post_fork hook in
+config/gunicorn/prod.py. Connections belong to the thread that opened them,
+so WarmThreadWorker opens them in each of its request threads.
+"""
+
+import inspect
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.db import connections
+from gunicorn.workers.gthread import ThreadWorker
+from django.urls import NoReverseMatch, get_resolver, resolve, reverse
+from rest_framework.serializers import BaseSerializer
+
+logger = logging.getLogger(__name__)
+
+
+def warm_up_urls():
+    from store import urls
+
+    get_resolver()._populate()
+    for pattern in urls.urlpatterns:
+        if pattern.name is None:
+            continue
+        kwargs = {name: "1" for name in pattern.pattern.regex.groupindex}
+        kwargs.pop("format", None)
+        try:
+            resolve(reverse(pattern.name, kwargs=kwargs))
+        except NoReverseMatch:
+            # e.g. a lookup that only matches UUIDs, compiling it is enough
+            pass
+
+
+def warm_up_serializers():
+    from core import serializers as core_serializers
+    from store import serializers as store_serializers
+    from store import views
+
+    for module in [store_serializers, core_serializers]:
+        for _, serializer_class in inspect.getmembers(module, inspect.isclass):
+            if (
+                issubclass(serializer_class, BaseSerializer)
+                and serializer_class.__module__ == module.__name__
+            ):
+                serializer_class().fields
+
+    for _, viewset in inspect.getmembers(views, inspect.isclass):
+        if getattr(viewset, "read_plan", None) is not None:
+            viewset.read_plan.get_columns()
+
+
+def warm_up_database():
+    for connection in connections.all():
+        connection.ensure_connection()
+
+
+def warm_up():
+    for step in [warm_up_urls, warm_up_serializers]:
+        try:
+            step()
+        except Exception:
+            # A cold worker is still better than no worker
+            logger.exception("Warm-up step %s failed", step.__name__)
+
+
+def warm_up_thread():
+    try:
+        warm_up_database()
+    except Exception:
+        # Connects on its first request instead
+        logger.exception("Connecting request thread %s failed", threading.get_ident())
+
+
+class WarmThreadWorker(ThreadWorker):
+    """
+    gunicorn's gthread worker, with all of its request threads started and
+    connected to the database before it accepts requests.
+    """
+
+    # How long to wait for the request threads to connect
+    warm_up_timeout = 30
+
+    def get_thread_pool(self):
+        threads = self.cfg.threads
+        pool = ThreadPoolExecutor(max_workers=threads, initializer=warm_up_thread)
+        # The pool starts a thread per submitted task while none is idle, and
+        # each of these tasks waits for all the others
+        barrier = threading.Barrier(threads, timeout=self.warm_up_timeout)
+        for future in [pool.submit(barrier.wait) for _ in range(threads)]:
+            try:
+                future.result()
+            except threading.BrokenBarrierError:
+                pass
+        return pool
@@ -18,3 +18,8 @@ class TaggedItem(models.Model):
 
     def __str__(self) -> str:
         return f"{self.tag.label} {self.object_id}"
+
+    class Meta:
+        # Looking up the tags of one object
+        indexes = [models.Index(fields=["content_type", "object_id"])]
+